@@ -19,9 +19,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import sys
 import struct
+import numpy as np
 
 class PatchError(Exception): pass
+class AlreadyPatchedError(PatchError): pass
 
 class BFIPatcher(object):
     """Patches .ELF files compiled for Evergreen GPUs; changes the microcode
@@ -42,15 +45,20 @@ class BFIPatcher(object):
         self.interface.debug('Patch complete, returning to kernel...')
         return data[:innerPos] + patched
 
+    def isPatched(self, data):
+        """Check whether an ELF has BFI_INT instructions in it already. The
+        compiler never emits them, so it must have been patched before.
+        """
+
+        inner = data[self.locateInner(data):]
+        offset, size = self.locateText(inner)
+        text2 = inner[offset:offset+size]
+        inst = np.frombuffer(text2, dtype='<u8', count=len(text2)/8)
+        return bool(np.any((inst & np.uint64(0x9003f00002001000)) ==
+            np.uint64(0x0000c00000000000)))
+
     def patchInner(self, data):
-        sections = self.readELFSections(data)
-        # We're looking for .text -- there should be two of them.
-        textSections = filter(lambda x: x[0] == '.text', sections)
-        if len(textSections) != 2:
-            self.interface.debug('Inner ELF does not have 2 .text sections!')
-            self.interface.debug('Sections are: %r' % sections)
-            raise PatchError()
-        name, offset, size = textSections[1]
+        offset, size = self.locateText(data)
         before, text2, after = (data[:offset], data[offset:offset+size],
             data[offset+size:])
 
@@ -59,20 +67,38 @@ class BFIPatcher(object):
         return before + text2 + after
 
     def patchInstructions(self, data):
-        output = ''
-        nPatched = 0
-        for i in xrange(len(data)/8):
-            inst, = struct.unpack('Q', data[i*8:i*8+8])
-            # Is it BYTE_ALIGN_INT?
-            if (inst&0x9003f00002001000) == 0x0001a00000000000:
-                nPatched += 1
-                inst ^=  (0x0001a00000000000 ^ 0x0000c00000000000) # BFI_INT
-            output += struct.pack('Q', inst)
+        # The whole section is scanned and patched as an array of 64-bit
+        # instruction words. Reading it doesn't copy the data; only the
+        # patched output is a new buffer.
+        count = len(data)/8
+        inst = np.frombuffer(data, dtype='<u8', count=count)
+        # Is it BYTE_ALIGN_INT?
+        matches = (inst & np.uint64(0x9003f00002001000)) == \
+            np.uint64(0x0001a00000000000)
+        nPatched = int(np.count_nonzero(matches))
         self.interface.debug('BFI-patched %d instructions...' % nPatched)
         if nPatched < 60:
             self.interface.debug('Patch safety threshold not met!')
             raise PatchError()
-        return output
+        # BFI_INT
+        flip = np.uint64(0x0001a00000000000 ^ 0x0000c00000000000)
+        output = inst ^ (matches.astype('<u8') * flip)
+        return output.tostring() + data[count*8:]
+
+    def locateText(self, data):
+        """Find the offset and size of the .text section to patch in the
+        inner ELF.
+        """
+
+        sections = self.readELFSections(data)
+        # We're looking for .text -- there should be two of them.
+        textSections = filter(lambda x: x[0] == '.text', sections)
+        if len(textSections) != 2:
+            self.interface.debug('Inner ELF does not have 2 .text sections!')
+            self.interface.debug('Sections are: %r' % sections)
+            raise PatchError()
+        name, offset, size = textSections[1]
+        return offset, size
 
     def locateInner(self, data):
         """ATI uses an ELF-in-an-ELF. I don't know why. This function's job is
@@ -119,4 +145,66 @@ class BFIPatcher(object):
             return sections
         except struct.error:
             self.interface.debug('A struct.error occurred while reading ELF!')
-            raise PatchError()
\ No newline at end of file
+            raise PatchError()
+
+    def patchFile(self, fileName):
+        """Patch a compiled program in place. This is for programs compiled
+        with -DBFI_INT but never patched. The kernels' binary cache already
+        holds patched programs, and those are refused.
+        """
+
+        binary = open(fileName, 'rb')
+        try:
+            data = binary.read()
+        finally:
+            binary.close()
+
+        if self.isPatched(data):
+            raise AlreadyPatchedError()
+
+        patched = self.patch(data)
+
+        binary = open(fileName, 'wb')
+        try:
+            binary.write(patched)
+        finally:
+            binary.close()
+
+class ConsoleInterface(object):
+    """Stands in for the KernelInterface when patching from the command
+    line.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def debug(self, msg):
+        if self.verbose:
+            print msg
+
+if __name__ == '__main__':
+    # Patch unpatched binaries in bulk, without starting the miner. Binaries
+    # that can't be patched, or already are, are left alone.
+    args = sys.argv[1:]
+    verbose = '-v' in args
+    args = [arg for arg in args if arg != '-v']
+    if not args:
+        print 'Usage: %s [-v] FILE...' % sys.argv[0]
+        sys.exit(2)
+
+    patcher = BFIPatcher(ConsoleInterface(verbose))
+    failed = 0
+    for fileName in args:
+        try:
+            patcher.patchFile(fileName)
+            print '%s: patched' % fileName
+        except AlreadyPatchedError:
+            print '%s: already patched' % fileName
+            failed += 1
+        except PatchError:
+            print '%s: not patched' % fileName
+            failed += 1
+        except IOError, e:
+            print '%s: %s' % (fileName, e.strerror)
+            failed += 1
+    sys.exit(1 if failed else 0)
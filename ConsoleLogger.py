@@ -20,6 +20,7 @@
 # THE SOFTWARE.
 
 import sys
+import json
 from time import time
 from datetime import datetime
 
@@ -41,15 +42,23 @@ def formatNumber(n):
     return '%s%s %s' % (whole, decimal, prefixes[i])
 
 class ConsoleLogger(object):
-    """This class will handle printing messages to the console."""
+    """This class will handle printing messages to the console.
+
+    When the output isn't a terminal, the status line can't be redrawn in
+    place, so it's written as a line of its own every PIPE_UPDATE_TIME seconds
+    instead.
+    """
 
     TIME_FORMAT = '[%d/%m/%Y %H:%M:%S]'
 
     UPDATE_TIME = 1.0
+    PIPE_UPDATE_TIME = 60.0
 
-    def __init__(self, miner, verbose=False):
+    def __init__(self, miner, verbose=False, output=None):
         self.verbose = verbose
         self.miner = miner
+        self.output = output or sys.stdout
+        self.redraw = self.output.isatty()
         self.lastUpdate = time() - 1
         self.rate = 0
         self.accepted = 0
@@ -100,19 +109,42 @@ class ConsoleLogger(object):
         if self.verbose:
             self.log(message)
 
+    def getDropped(self):
+        """Return how many writes the output has dropped, if it drops any."""
+        return getattr(self.output, 'dropped', 0)
+
+    def close(self):
+        """Finish writing out everything logged so far, if the output writes
+        in the background. The reactor's shutdown does this anyway; this is
+        for exiting without one.
+        """
+        close = getattr(self.output, 'close', None)
+        if close is not None and self.output is not sys.stdout:
+            close()
+
     def updateStatus(self, force=False):
         #only update if last update was more than a second ago
         dt = time() - self.lastUpdate
+        if not self.redraw:
+            force = False
+            if dt <= self.PIPE_UPDATE_TIME:
+                return
         if force or dt > self.UPDATE_TIME:
             rate = self.rate if (not self.miner.idle) else 0
-            type = " [" + str(self.connectionType) + "]" if self.connectionType is not None else ''
-            status = (
-                "[" + formatNumber(rate) + "hash/sec] "
-                "[" + str(self.accepted) + " Accepted] "
-                "[" + str(self.invalid) + " Rejected]" + type)
-            self.say(status)
+            self.sayStatus(rate)
             self.lastUpdate = time()
 
+    def sayStatus(self, rate):
+        type = " [" + str(self.connectionType) + "]" if self.connectionType is not None else ''
+        dropped = self.getDropped()
+        if dropped:
+            type += " [" + str(dropped) + " Dropped]"
+        status = (
+            "[" + formatNumber(rate) + "hash/sec] "
+            "[" + str(self.accepted) + " Accepted] "
+            "[" + str(self.invalid) + " Rejected]" + type)
+        self.say(status, not self.redraw)
+
     def say(self, message, newLine=False, hideTimestamp=False):
         #add new line if requested
         if newLine:
@@ -124,23 +156,46 @@ class ConsoleLogger(object):
 
             message = timestamp + message
 
+        length = len(message)
+
         #erase the previous line
         if self.lineLength > 0:
-            sys.stdout.write('\b \b' * self.lineLength)
-            sys.stdout.write(' ' * self.lineLength)
-            sys.stdout.write('\b \b' * self.lineLength)
+            message = ('\b \b' * self.lineLength + ' ' * self.lineLength +
+                '\b \b' * self.lineLength + message)
 
         #print the line
-        sys.stdout.write(message)
-        sys.stdout.flush()
+        self.output.write(message)
+        self.output.flush()
 
         #cache the current line length
-        if newLine:
+        if newLine or not self.redraw:
             self.lineLength = 0
         else:
-            self.lineLength = len(message)
+            self.lineLength = length
 
     def log(self, message, update=True, hideTimestamp=False):
         self.say(message, True, hideTimestamp)
         if update:
             self.updateStatus(True)
+
+class JSONLogger(ConsoleLogger):
+    """Logs JSON objects, one per line, for log collectors. Every object has
+    a "time" and a "type", which is either "message" or "status".
+    """
+
+    def __init__(self, miner, verbose=False, output=None):
+        ConsoleLogger.__init__(self, miner, verbose, output)
+        self.redraw = False
+
+    def sayStatus(self, rate):
+        self.write({'type': 'status', 'rate': rate * 1000,
+            'accepted': self.accepted, 'rejected': self.invalid,
+            'connection': self.connectionType, 'dropped': self.getDropped()})
+
+    def say(self, message, newLine=False, hideTimestamp=False):
+        self.write({'type': 'message', 'message': message})
+
+    def write(self, event):
+        event['time'] = time()
+        self.output.write(json.dumps(event, sort_keys=True) + '\n')
+        self.output.flush()
@@ -0,0 +1,74 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from time import time, sleep
+
+class DutyCycle(object):
+    """A DutyCycle paces a mining thread so its device is only kept busy for a
+    share of the time, and/or so no single execution takes longer than a
+    given latency. This is for machines that have to stay responsive for other
+    work while mining.
+
+    The mining thread calls begin() right before an execution and end() right
+    after it completes. end() sleeps for as long as the busy share requires,
+    and adjusts shift: the number of times kernels should halve the size of
+    their executions to stay under the latency target.
+    """
+
+    # How far under the latency target an execution has to be before it is
+    # allowed to double in size again. This avoids switching back and forth.
+    HEADROOM = 0.4
+
+    def __init__(self, busy=100, maxLatency=None, maxShift=0):
+        self.busy = min(100, max(1, busy))
+        self.maxLatency = maxLatency
+        self.maxShift = max(0, maxShift)
+        self.shift = 0
+        self.startedAt = None
+        self.idleTime = 0.0
+
+    def isActive(self):
+        """Returns True if the DutyCycle has anything to do."""
+        return self.busy < 100 or bool(self.maxLatency)
+
+    def begin(self):
+        """Called right before an execution is sent to the device."""
+        self.startedAt = time()
+
+    def end(self):
+        """Called right after an execution has completed."""
+        if self.startedAt is None:
+            return
+        elapsed = time() - self.startedAt
+        self.startedAt = None
+
+        if self.maxLatency:
+            if elapsed > self.maxLatency and self.shift < self.maxShift:
+                self.shift += 1
+            elif (elapsed * 2 < self.maxLatency * self.HEADROOM and
+                  self.shift > 0):
+                self.shift -= 1
+
+        if self.busy < 100:
+            idle = elapsed * (100 - self.busy) / self.busy
+            self.idleTime += idle
+            sleep(idle)
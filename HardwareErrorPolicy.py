@@ -0,0 +1,82 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+class HardwareErrorPolicy(object):
+    """Watches the hardware errors reported by a kernel's cores (nonces that
+    come back from the device but don't actually produce a share) and steps
+    through a list of remedies whenever they become too frequent compared to
+    the number of shares the cores should have found.
+
+    Each remedy is a callable that returns True if it could be applied, or
+    False to move straight on to the next one. After a remedy is applied, the
+    error rate is measured from scratch.
+    """
+
+    # Never act on fewer errors than this, however few shares were expected.
+    MIN_ERRORS = 5
+
+    def __init__(self, cores, threshold, remedies):
+        self.cores = cores
+        self.threshold = threshold
+        self.remedies = list(remedies)
+        self._reset()
+
+    def _totals(self):
+        errors = sum(core.hardwareErrors for core in self.cores)
+        nonces = sum(core.nonces for core in self.cores)
+        return errors, nonces
+
+    def _reset(self):
+        self.baseErrors, self.baseNonces = self._totals()
+
+    def getErrorRate(self):
+        """The hardware errors since the last remedy, as a percentage of the
+        shares that should have been found in that time.
+        """
+        errors, nonces = self._totals()
+        errors -= self.baseErrors
+        expected = (nonces - self.baseNonces) / float(2**32)
+        if not errors:
+            return 0.0
+        if not expected:
+            return float('inf')
+        return errors * 100 / expected
+
+    def check(self):
+        """Called after a hardware error has been reported. Applies the next
+        remedy if the threshold has been exceeded, returning True if it did.
+        """
+        if not self.threshold or not self.remedies:
+            return False
+
+        errors = self._totals()[0]
+        if errors - self.baseErrors < self.MIN_ERRORS:
+            return False
+        if self.getErrorRate() <= self.threshold:
+            return False
+
+        applied = False
+        while self.remedies and not applied:
+            applied = self.remedies.pop(0)()
+
+        self._reset()
+        return applied
@@ -20,9 +20,26 @@
 # THE SOFTWARE.
 
 import os
+from time import time
+from collections import deque
 from struct import pack, unpack
 from hashlib import sha256
 from twisted.internet import defer, reactor
+from twisted.python.threadable import isInIOThread
+from minerutil.Metrics import registry
+
+shares = registry.counter('phoenix_shares_total',
+    'Shares found, by what became of them.', ('result',))
+acceptedShares = shares.labels('accepted')
+rejectedShares = shares.labels('rejected')
+staleShares = shares.labels('stale')
+submitTime = registry.timer('phoenix_submit_seconds',
+    'Time from submitting a share to the server answering.')
+
+# Kernels time their executions with this, labelled with the kernel's name.
+executionTime = registry.timer('phoenix_kernel_execution_seconds',
+    'Time each kernel execution took, from being queued to its results being '
+    'read back.', ('kernel',))
 
 # I'm using this as a sentinel value to indicate that an option has no default;
 # it must be specified.
@@ -43,6 +60,8 @@ class KernelOption(object):
         self.advanced = advanced
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         if instance in self.localValues:
             return self.localValues[instance]
         else:
@@ -52,6 +71,34 @@ class KernelOption(object):
     def __set__(self, instance, value):
         self.localValues[instance] = value
 
+    def getValue(self, interface):
+        """Read the option through an interface, for use before the kernel
+        has been instantiated.
+        """
+        return interface._getOption(self.name, self.type, self.default)
+
+class SampleWindow(object):
+    """Keeps the last few samples, each a tuple of numbers, along with their
+    totals. Adding a sample costs the same however large the window is.
+    """
+
+    def __init__(self, size, width):
+        self.size = max(1, size)
+        self.samples = deque()
+        self.totals = [0] * width
+
+    def add(self, *sample):
+        self.samples.append(sample)
+        totals = self.totals
+        for i, value in enumerate(sample):
+            totals[i] += value
+        if len(self.samples) > self.size:
+            for i, value in enumerate(self.samples.popleft()):
+                totals[i] -= value
+
+    def __len__(self):
+        return len(self.samples)
+
 class CoreInterface(object):
     """An internal class provided for kernels to use when reporting info for
     one core.
@@ -61,26 +108,66 @@ class CoreInterface(object):
 
     def __init__(self, kernelInterface):
         self.kernelInterface = kernelInterface
-        self.averageSamples = []
+        numSamples = self.kernelInterface.miner.options.getAvgSamples()
+        # Each of these is (nonces, seconds).
+        self.rateSamples = SampleWindow(numSamples, 2)
+        # Each of these is (device time, host overhead).
+        self.timingSamples = SampleWindow(numSamples, 2)
+        self.nonces = 0
+        self.hardwareErrors = 0
         self.kernelInterface.miner._addCore(self)
 
     def updateRate(self, rate):
-        """Called by a kernel core to report its current rate."""
+        """Called by a kernel core to report its current rate, in Khash/sec.
+        Kernels that know how many nonces they checked, and in how long,
+        should use reportExecution instead.
+        """
+        self.rateSamples.add(rate * 1000, 1.0)
 
-        numSamples = self.kernelInterface.miner.options.getAvgSamples()
+    def reportExecution(self, nonces, seconds):
+        """Called when a core has checked some nonces in the given time. The
+        core's rate is taken over the last few executions, so that longer ones
+        count for more.
+        """
+        self.rateSamples.add(nonces, seconds)
+
+    def updateTiming(self, deviceTime, hostOverhead):
+        """Called when the time a core's device spent on an execution is
+        known separately from the host overhead around it.
+        """
+
+        self.timingSamples.add(deviceTime, hostOverhead)
 
-        self.averageSamples.append(rate)
-        self.averageSamples = self.averageSamples[-numSamples:]
+    def reportNonces(self, nonces):
+        """Called when a core has finished checking some nonces."""
+        self.nonces += nonces
 
-        self.kernelInterface.miner.updateAverage()
+    def reportHardwareError(self):
+        """Called by a kernel core when the device returned a nonce that
+        doesn't actually produce a share.
+        """
+        self.hardwareErrors += 1
 
     def getRate(self):
         """Retrieve the average rate for this core."""
 
-        if not self.averageSamples:
+        nonces, seconds = self.rateSamples.totals
+        if seconds <= 0:
             return 0
 
-        return sum(self.averageSamples)/len(self.averageSamples)
+        return int(nonces/seconds/1000)
+
+    def getTiming(self):
+        """Retrieve the average device time and host overhead (in seconds)
+        per execution for this core, or None if the kernel doesn't measure it.
+        """
+
+        samples = len(self.timingSamples)
+        if not samples:
+            return None
+
+        deviceTime, hostOverhead = self.timingSamples.totals
+        return (deviceTime/samples, hostOverhead/samples)
 
     def getKernelInterface(self):
         return self.kernelInterface
@@ -90,19 +177,24 @@ class KernelInterface(object):
     framework.
     """
 
-    def __init__(self, miner):
+    def __init__(self, miner, overrides=None):
         self.miner = miner
+        self.overrides = overrides or {}
         self._core = None
 
     def _getOption(self, name, type, default):
         """KernelOption uses this to read the actual value of the option."""
-        if not name in self.miner.options.kernelOptions:
+        options = self.miner.options.kernelOptions
+        if name in self.overrides:
+            options = self.overrides
+
+        if not name in options:
             if default == REQUIRED:
                 self.fatal('Required option %s not provided!' % name)
             else:
                 return default
 
-        givenOption = self.miner.options.kernelOptions[name]
+        givenOption = options[name]
         if type == bool:
             # The following are considered true
             return givenOption is None or \
@@ -113,6 +205,15 @@ class KernelInterface(object):
         except (TypeError, ValueError):
             self.fatal('Option %s expects a value of type %s!' % (name, type))
 
+    def forDevice(self, device):
+        """Return a new KernelInterface for another instance of the kernel,
+        which sees the given DEVICE instead of the one the user specified.
+        """
+
+        overrides = dict(self.overrides)
+        overrides['DEVICE'] = str(device)
+        return KernelInterface(self.miner, overrides)
+
     def getRevision(self):
         """Return the Phoenix core revision, so that kernels can require a
         minimum revision before operating (such as if they rely on a certain
@@ -204,6 +305,7 @@ class KernelInterface(object):
         # Check if the block has changed while this NonceRange was being
         # processed by the kernel. If so, don't send it to the server.
         if self.miner.queue.isRangeStale(nr):
+            staleShares.inc()
             return False
 
         # Check if the hash meets the full difficulty before sending.
@@ -211,8 +313,14 @@ class KernelInterface(object):
 
         if self.checkTarget(hash, nr.unit.target):
             formattedResult = pack('<76sI', nr.unit.data[:76], nonce)
+            sentAt = time()
             d = self.miner.connection.sendResult(formattedResult)
             def callback(accepted):
+                submitTime.since(sentAt)
+                if accepted:
+                    acceptedShares.inc()
+                else:
+                    rejectedShares.inc()
                 self.miner.logger.reportFound(hash, accepted)
             d.addCallback(callback)
             return True
@@ -225,14 +333,26 @@ class KernelInterface(object):
         """Log information as debug so that it can be viewed only when -v is
         enabled.
         """
+        # Kernels may log from their own threads (e.g. while building), but
+        # the logger belongs to the reactor.
+        if reactor.running and not isInIOThread():
+            reactor.callFromThread(self.debug, msg)
+            return
         self.miner.logger.reportDebug(msg)
 
     def log(self, msg, withTimestamp=True, withIdentifier=True):
         """Log some general kernel information to the console."""
+        if reactor.running and not isInIOThread():
+            reactor.callFromThread(self.log, msg, withTimestamp,
+                withIdentifier)
+            return
         self.miner.logger.log(msg, True, not withTimestamp)
 
     def error(self, msg=None):
         """The kernel has an issue that requires user attention."""
+        if reactor.running and not isInIOThread():
+            reactor.callFromThread(self.error, msg)
+            return
         if msg is not None:
             self.miner.logger.log('Kernel error: ' + msg)
 
@@ -242,6 +362,28 @@ class KernelInterface(object):
         """
         if msg is not None:
             self.miner.logger.log('FATAL kernel error: ' + msg, False)
+        # os._exit skips the shutdown triggers, so the log is finished here,
+        # or this message would never be written.
+        close = getattr(self.miner.logger, 'close', None)
+        if close is not None:
+            close()
         if reactor.running:
             reactor.stop()
         os._exit(0)
+
+class KernelGroup(object):
+    """Runs several instances of a kernel, one per device, as if they were a
+    single kernel. Every instance has its own cores and QueueReaders, but they
+    all share the Miner's WorkQueue and connection.
+    """
+
+    def __init__(self, kernels):
+        self.kernels = kernels
+
+    def start(self):
+        for kernel in self.kernels:
+            kernel.start()
+
+    def stop(self):
+        for kernel in self.kernels:
+            kernel.stop()
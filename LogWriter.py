@@ -0,0 +1,96 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import sys
+import threading
+from Queue import Queue, Empty, Full
+
+from minerutil.Metrics import registry
+
+droppedWrites = registry.counter('phoenix_log_dropped_total',
+    'Log writes dropped because the output could not keep up.')
+
+class LogWriter(object):
+    """Writes to a file (stdout by default) from a thread of its own, so that
+    a slow reader, such as a pipe to a log collector, never holds up the
+    reactor.
+
+    Writes wait in a bounded queue. When the queue is full, further writes are
+    dropped and counted rather than waited on.
+    """
+
+    QUEUE_SIZE = 1000
+
+    def __init__(self, file=None, queueSize=QUEUE_SIZE):
+        self.file = file or sys.stdout
+        self.queue = Queue(queueSize)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='log writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def isatty(self):
+        try:
+            return self.file.isatty()
+        except AttributeError:
+            return False
+
+    def write(self, text):
+        try:
+            self.queue.put_nowait(text)
+        except Full:
+            self.dropped += 1
+            droppedWrites.inc()
+
+    def flush(self):
+        """The writer thread flushes whenever it runs out of things to write,
+        so there's nothing to do here.
+        """
+
+    def run(self):
+        while True:
+            text = self.queue.get()
+            chunks = []
+            # Write everything that has piled up at once.
+            while text is not None:
+                chunks.append(text)
+                try:
+                    text = self.queue.get_nowait()
+                except Empty:
+                    break
+            try:
+                self.file.write(''.join(chunks))
+                self.file.flush()
+            except (IOError, ValueError):
+                pass
+            if text is None:
+                return
+
+    def close(self, timeout=5.0):
+        """Write whatever is still waiting, for up to TIMEOUT seconds, and
+        stop the writer thread.
+        """
+        try:
+            self.queue.put(None, True, timeout)
+        except Full:
+            return
+        self.thread.join(timeout)
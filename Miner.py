@@ -22,8 +22,11 @@
 import platform
 from time import time
 from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 from minerutil.MMPProtocol import MMPClient
 from KernelInterface import KernelInterface
+from Profiler import Profiler
+from minerutil.Metrics import registry
 
 #The main managing class for the miner itself.
 class Miner(object):
@@ -33,6 +36,9 @@ class Miner(object):
     REVISION = reduce(lambda x,y: x*100+y, VER)
     VERSION = 'v%s' % '.'.join(str(x) for x in VER)
 
+    # How often, in seconds, to add up the rates of all cores.
+    RATE_INTERVAL = 1.0
+
     def __init__(self):
         self.logger = None
         self.options = None
@@ -45,6 +51,33 @@ class Miner(object):
         self.failures = 0
         self.lastMetaRate = 0.0
         self.lastRateUpdate = time()
+        self.profiler = Profiler()
+        self.rateUpdater = LoopingCall(self.updateAverage)
+        self.idleSince = None
+        self.idleTime = 0.0
+
+        registry.gauge('phoenix_core_rate_khash',
+            'The average rate of each core, in Khash/sec.',
+            lambda: [((i,), core.getRate()) for i, core in self._cores()],
+            ('core',))
+        registry.gauge('phoenix_core_nonces_total',
+            'The nonces each core has checked.',
+            lambda: [((i,), core.nonces) for i, core in self._cores()],
+            ('core',), 'counter')
+        registry.gauge('phoenix_core_hardware_errors_total',
+            'Nonces from each core that did not produce a share.',
+            lambda: [((i,), core.hardwareErrors) for i, core in self._cores()],
+            ('core',), 'counter')
+        registry.gauge('phoenix_core_device_seconds',
+            'The average time the device spent on each execution, for cores '
+            'that time it (e.g. OpenCL kernels with PROFILE).',
+            lambda: self._timings(0), ('core',))
+        registry.gauge('phoenix_core_host_overhead_seconds',
+            'The average host time around each execution, for cores that '
+            'time the device.',
+            lambda: self._timings(1), ('core',))
+        registry.gauge('phoenix_idle_seconds_total',
+            'Time spent without work.', self.getIdleTime, type='counter')
 
     # Connection callbacks...
     def onFailure(self):
@@ -139,13 +172,17 @@ class Miner(object):
 
         self.applyMeta()
 
-        # Go!
+        # Go! Kernels build their programs in the background, so the connection
+        # and the first work are set up while that's still going on.
         self.connection.connect()
         self.kernel.start()
+        self.rateUpdater.start(self.RATE_INTERVAL, now=False)
         reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
 
     def shutdown(self):
         """Disconnect from the server and kill the kernel."""
+        if self.rateUpdater.running:
+            self.rateUpdater.stop()
         self.kernel.stop()
         self.connection.disconnect()
 
@@ -166,8 +203,21 @@ class Miner(object):
     def _addCore(self, core):
         self.cores.append(core)
 
+    def _cores(self):
+        return enumerate(list(self.cores))
+
+    def _timings(self, index):
+        timings = [(i, core.getTiming()) for i, core in self._cores()]
+        return [((i,), timing[index]) for i, timing in timings
+            if timing is not None]
+
     #used by WorkQueue to report when the miner is idle
     def reportIdle(self, idle):
+        if idle and self.idleSince is None:
+            self.idleSince = time()
+        elif not idle and self.idleSince is not None:
+            self.idleTime += time() - self.idleSince
+            self.idleSince = None
 
         #if idle status has changed force an update
         if self.idle != idle:
@@ -182,6 +232,12 @@ class Miner(object):
                 self.idle = idle
                 self.logger.updateStatus(True)
 
+    def getIdleTime(self):
+        """Return the total time the miner has spent without work."""
+        if self.idleSince is not None:
+            return self.idleTime + time() - self.idleSince
+        return self.idleTime
+
     #request work from the protocol every 15 seconds while idle
     def idleFixer(self):
         if self.idle:
@@ -198,7 +254,8 @@ class Miner(object):
 
         self.logger.reportRate(total)
 
-        # Let's not spam the server with rate messages.
-        if self.lastMetaRate+30 < time():
+        # Let's not spam the server with rate messages. Servers may size work
+        # by the rate, so don't tell them it's 0 before it has been measured.
+        if total and self.lastMetaRate+30 < time():
             self.connection.setMeta('rate', total)
             self.lastMetaRate = time()
@@ -0,0 +1,628 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import pyopencl as cl
+import numpy as np
+import os
+import math
+
+from hashlib import md5
+from struct import pack, unpack
+from time import time
+from twisted.internet import reactor, threads
+
+from minerutil.Midstate import calculateMidstate
+from QueueReader import QueueReader
+from DutyCycle import DutyCycle
+from HardwareErrorPolicy import HardwareErrorPolicy
+from KernelInterface import *
+from BFIPatcher import *
+
+class OpenCLKernelData(object):
+    """This class is a container for all the data required for a single kernel
+    execution. Kernels subclass it to add the values their OpenCL code
+    precomputes on the host, and to list the arguments it takes if those
+    differ from the usual ones.
+    """
+
+    # How many precomputed values calculateF fills in.
+    F_SIZE = 0
+
+    def __init__(self, nonceRange, core, rateDivisor, aggression):
+        # Prepare some raw data, converting it into the form that the OpenCL
+        # function expects.
+        data = np.array(
+               unpack('IIII', nonceRange.unit.data[64:]), dtype=np.uint32)
+
+        # get the number of iterations from the aggression and size
+        self.iterations = int(nonceRange.size / (1 << aggression))
+        self.iterations = max(1, self.iterations)
+
+        #set the size to pass to the kernel based on iterations and vectors
+        self.size = (nonceRange.size / rateDivisor) / self.iterations
+
+        # The kernel works out the nonces for each vector component and each
+        # execution (through the global offset) by itself, so a single base
+        # serves the whole range however many iterations it takes.
+        self.base = pack('I', nonceRange.base/rateDivisor)
+
+        #set up state and precalculated static data
+        self.state = np.array(
+            unpack('IIIIIIII', nonceRange.unit.midstate), dtype=np.uint32)
+        self.state2 = np.array(unpack('IIIIIIII',
+            calculateMidstate(nonceRange.unit.data[64:80] +
+                '\x00\x00\x00\x80' + '\x00'*40 + '\x80\x02\x00\x00',
+                nonceRange.unit.midstate, 3)), dtype=np.uint32)
+        self.state2 = np.array(
+            list(self.state2)[3:] + list(self.state2)[:3], dtype=np.uint32)
+        self.nr = nonceRange
+        self.rateDivisor = rateDivisor
+        self.aggression = aggression
+
+        self.f = np.zeros(self.F_SIZE, np.uint32)
+        self.calculateF(data)
+
+        # The arguments are converted once here, outside of the mining thread.
+        self.arguments = self.getArguments()
+
+    def calculateF(self, data):
+        """Precompute the values that stay the same for the whole WorkUnit."""
+
+    def getArguments(self):
+        """Return the arguments to the search kernel, except for the output
+        buffer that always comes last. These are in the order the search
+        kernel declares them: by default the midstate, most of the second
+        midstate, the base and then every value from calculateF. Kernels that
+        take anything else override this.
+        """
+        return (
+            self.state[0], self.state[1], self.state[2], self.state[3],
+            self.state[4], self.state[5], self.state[6], self.state[7],
+            self.state2[1], self.state2[2], self.state2[3],
+            self.state2[5], self.state2[6], self.state2[7],
+            self.base) + tuple(self.f)
+
+class KernelStream(object):
+    """One of the independent streams of executions that an OpenCLKernel keeps
+    in flight on its device, each with its own command queue, result buffer,
+    QueueReader and mining thread. Every stream fetches its own ranges from
+    the WorkQueue, so streams never work on the same nonces.
+    """
+
+    def __init__(self, kernel):
+        self.core = kernel.interface.addCore()
+        self.loopExponent = 0
+        self.commandQueue = None
+        self.search = None
+        self.generation = None
+        self.rateDivisor = None
+
+        # This paces the mining thread when DUTY or MAXLATENCY are given.
+        maxLatency = kernel.MAXLATENCY
+        if maxLatency is not None:
+            maxLatency /= 1000.0
+        self.duty = DutyCycle(kernel.DUTY, maxLatency, kernel.AGGRESSION - 16)
+
+        # We need a QueueReader to efficiently provide our dedicated thread
+        # with work.
+        self.qr = QueueReader(self.core,
+            lambda nr: kernel.preprocess(nr, self),
+            lambda x,y: kernel.size * 1 << self.loopExponent)
+
+    def load(self, kernel):
+        """Set up the device-side resources for the kernel's current program.
+        This runs in the stream's own mining thread.
+        """
+        self.generation = kernel.generation
+        properties = 0
+        if kernel.PROFILE:
+            properties = cl.command_queue_properties.PROFILING_ENABLE
+        self.commandQueue = cl.CommandQueue(kernel.context,
+            properties=properties)
+        self.search = cl.Kernel(kernel.kernel, 'search')
+        self.output = np.zeros(kernel.OUTPUT_SIZE+1, np.uint32)
+        self.output_buf = cl.Buffer(
+            kernel.context,
+            cl.mem_flags.WRITE_ONLY | cl.mem_flags.USE_HOST_PTR,
+            hostbuf=self.output)
+        self.rateDivisor = kernel.programRateDivisor
+
+class OpenCLKernel(object):
+    """The host side shared by Phoenix's OpenCL kernels: device selection,
+    building and caching the program, the mining threads and handling
+    results.
+
+    A kernel subclasses this, pointing SOURCE at its OpenCL code and
+    KernelData at its OpenCLKernelData subclass. It may extend setupDefines
+    for defines of its own.
+    """
+
+    PLATFORM = KernelOption(
+        'PLATFORM', int, default=None,
+        help='The ID of the OpenCL platform to use')
+    DEVICE = KernelOption(
+        'DEVICE', int, default=None,
+        help='The ID of the OpenCL device to use, a comma-separated list of '
+        'IDs or "all" to mine on several devices')
+    VECTORS = KernelOption(
+        'VECTORS', bool, default=False, advanced=True,
+        help='Enable vector support in the kernel?')
+    FASTLOOP = KernelOption(
+        'FASTLOOP', bool, default=True, advanced=True,
+        help='Run iterative mining thread?')
+    AGGRESSION = KernelOption(
+        'AGGRESSION', int, default=5, advanced=True,
+        help='Exponential factor indicating how much work to run '
+        'per OpenCL execution')
+    WORKSIZE = KernelOption(
+        'WORKSIZE', int, default=None, advanced=True,
+        help='The worksize to use when executing CL kernels.')
+    BFI_INT = KernelOption(
+        'BFI_INT', bool, default=True, advanced=True,
+        help='Use the BFI_INT instruction for AMD/ATI GPUs.')
+    STREAMS = KernelOption(
+        'STREAMS', int, default=1, advanced=True,
+        help='How many executions to keep in flight on the device at once')
+    PROFILE = KernelOption(
+        'PROFILE', bool, default=False, advanced=True,
+        help='Time executions with OpenCL profiling events?')
+    DUTY = KernelOption(
+        'DUTY', int, default=100, advanced=True,
+        help='Percentage of the time to keep the device busy')
+    MAXLATENCY = KernelOption(
+        'MAXLATENCY', int, default=None, advanced=True,
+        help='Longest a single execution may take, in milliseconds')
+    HWERRORS = KernelOption(
+        'HWERRORS', float, default=5.0, advanced=True,
+        help='Percentage of hardware errors (compared to the expected shares) '
+        'to tolerate before taking action, or 0 to only count them')
+    OUTPUT_SIZE = 0x100
+
+    # The name reported to the server, and the path to the OpenCL source.
+    # Compiled programs are cached next to the source.
+    NAME = None
+    SOURCE = None
+
+    # The OpenCLKernelData subclass that prepares each range.
+    KernelData = None
+
+    # This must be manually set for Git
+    REVISION = 121
+
+    # How many threads the instances of every OpenCL kernel hold from the
+    # reactor's thread pool, which is enlarged as each instance is created.
+    poolThreads = 0
+
+    @classmethod
+    def getDevices(cls, interface):
+        """Return the ID of every device on the selected platform, used when
+        the user asks for DEVICE=all.
+        """
+        platforms = cl.get_platforms()
+        platform = cls.PLATFORM.getValue(interface)
+        if platform is None and len(platforms) == 1:
+            platform = 0
+        if platform is None or platform >= len(platforms):
+            return []
+        return range(len(platforms[platform].get_devices()))
+
+    def __init__(self, interface):
+        platforms = cl.get_platforms()
+
+        # Initialize object attributes and retrieve command-line options...)
+        self.device = None
+        self.kernel = None
+        self.interface = interface
+        self.defines = ''
+        self.rateDivisor = 1
+        self.context = None
+        self.generation = 0
+        self.programRateDivisor = None
+
+        # Set the initial number of nonces to run per execution
+        # 2^(16 + aggression)
+        self.AGGRESSION += 16
+        self.AGGRESSION = min(32, self.AGGRESSION)
+        self.AGGRESSION = max(16, self.AGGRESSION)
+        self.size = 1 << self.AGGRESSION
+
+        # Each stream works its own ranges, so several executions can be queued
+        # on the device while the host is busy turning another one around.
+        self.STREAMS = max(1, self.STREAMS)
+        self.streams = [KernelStream(self) for i in range(self.STREAMS)]
+
+        # When the device keeps returning bad results, these are tried in turn.
+        self.errorPolicy = HardwareErrorPolicy(
+            [stream.core for stream in self.streams], self.HWERRORS,
+            [self.reduceAggression, self.disableBFI, self.disableVectors,
+             self.rebuild, self.failDevice])
+
+        # The platform selection must be valid to mine.
+        if self.PLATFORM >= len(platforms) or \
+            (self.PLATFORM is None and len(platforms) > 1):
+            self.interface.log(
+                'Wrong platform or more than one OpenCL platform found, '
+                'use PLATFORM=ID to select one of the following\n',
+                False, True)
+
+            for i,p in enumerate(platforms):
+                self.interface.log('    [%d]\t%s' % (i, p.name), False, False)
+
+            # Since the platform is invalid, we can't mine.
+            self.interface.fatal()
+            return
+        elif self.PLATFORM is None:
+            self.PLATFORM = 0
+
+        devices = platforms[self.PLATFORM].get_devices()
+
+        # The device selection must be valid to mine.
+        if self.DEVICE >= len(devices) or \
+            (self.DEVICE is None and len(devices) > 1):
+            self.interface.log(
+                'No device specified or device not found, '
+                'use DEVICE=ID to specify one of the following\n',
+                False, True)
+
+            for i,d in enumerate(devices):
+                self.interface.log('    [%d]\t%s' % (i, d.name), False, False)
+
+            # Since the device selection is invalid, we can't mine.
+            self.interface.fatal()
+            return
+        elif self.DEVICE is None:
+            self.DEVICE = 0
+
+        self.device = devices[self.DEVICE]
+
+        # Each stream's mining thread keeps its thread from the pool for as
+        # long as Phoenix runs, and building the program takes another one for
+        # a while. With several devices these add up, and getwork requests
+        # still need threads of their own.
+        OpenCLKernel.poolThreads += len(self.streams) + 1
+        reactor.suggestThreadPoolSize(max(10, OpenCLKernel.poolThreads + 5))
+
+        # The mining threads are not started until the program is built.
+        self.buildProgram()
+
+        self.applyMeta()
+
+    def applyMeta(self):
+        """Apply any kernel-specific metadata."""
+        self.interface.setMeta('kernel', '%s r%s' % (self.NAME, self.REVISION))
+        self.interface.setMeta('device', self.device.name.replace('\x00',''))
+        self.interface.setMeta('cores', self.device.max_compute_units)
+
+    def buildProgram(self, useCache=True):
+        """Build the program for the current options. Working out the build
+        options for the device is quick, so it's done right away...
+        """
+        self.defines = ''
+        self.setupKernel(self.device)
+
+        # ...but building the program can take a long time, so that happens in
+        # a separate thread (while Phoenix connects to the server, at first).
+        self.loaded = threads.deferToThread(self.loadKernel, self.device,
+            self.defines, self.BFI_INT, useCache)
+        self.loaded.addCallbacks(self.kernelLoaded, self.kernelFailed,
+            callbackArgs=(self.rateDivisor,))
+
+    def setupKernel(self, device):
+        """Determine the worksize and compiler defines for the device."""
+
+        # get the maximum worksize of the device
+        maxWorkSize = self.device.get_info(cl.device_info.MAX_WORK_GROUP_SIZE)
+
+        # If the user didn't specify their own worksize,
+        # use the maximum supported worksize of the device
+        if self.WORKSIZE is None:
+            self.interface.debug('WORKSIZE not supplied, using HW max. of '
+                                 + str(maxWorkSize))
+            self.WORKSIZE = maxWorkSize
+        else:
+            # If the worksize is larger than the maximum supported
+            # worksize of the device
+            if (self.WORKSIZE > maxWorkSize):
+                self.interface.error('WORKSIZE out of range, using HW max. of '
+                                     + str(maxWorkSize))
+                self.WORKSIZE = maxWorkSize
+
+        # These definitions are required for the kernel to function.
+        self.defines += (' -DOUTPUT_SIZE=' + str(self.OUTPUT_SIZE))
+        self.defines += (' -DOUTPUT_MASK=' + str(self.OUTPUT_SIZE - 1))
+        self.defines += (' -DWORKSIZE=' + str(self.WORKSIZE))
+
+        self.setupDefines(device)
+
+        # Some AMD devices support a special "bitalign" instruction that makes
+        # bitwise rotation (required for SHA-256) much faster.
+        if (device.extensions.find('cl_amd_media_ops') != -1):
+            self.defines += ' -DBITALIGN'
+            #enable the expierimental BFI_INT instruction optimization
+            if self.BFI_INT:
+                self.defines += ' -DBFI_INT'
+        else:
+            #since BFI_INT requires cl_amd_media_ops, disable it
+            if self.BFI_INT:
+                self.BFI_INT = False
+
+    def setupDefines(self, device):
+        """Add the defines that depend on the kernel's own options. Kernels
+        that have more of these extend this, and must set rateDivisor to the
+        number of nonces each work item checks.
+        """
+
+        # If the user wants to mine with vectors, enable the appropriate code
+        # in the kernel source.
+        if self.VECTORS:
+            self.defines += ' -DVECTORS'
+            self.rateDivisor = 2
+        else:
+            self.rateDivisor = 1
+
+    def loadKernel(self, device, defines, bfi, useCache=True):
+        """Load the kernel and initialize the device. This runs outside of the
+        reactor thread, so problems are raised rather than reported.
+        """
+        context = cl.Context([device], None, None)
+
+        # Read the OpenCL source code.
+        kernelFile = open(self.SOURCE, 'r')
+        kernel = kernelFile.read()
+        kernelFile.close()
+
+        # For fast startup, we cache the compiled OpenCL code. The name of the
+        # cache is determined as the hash of a few important,
+        # compilation-specific pieces of information.
+        m = md5()
+        m.update(device.platform.name)
+        m.update(device.platform.version)
+        m.update(device.name)
+        m.update(defines)
+        m.update(kernel)
+        cacheName = '%s.elf' % m.hexdigest()
+
+        fileName = os.path.join(os.path.dirname(self.SOURCE), cacheName)
+
+        # Finally, the actual work of loading the kernel...
+        try:
+            binary = open(fileName, 'rb') if useCache else None
+        except IOError:
+            binary = None
+
+        try:
+            if binary is None:
+                program = cl.Program(
+                    context, kernel).build(defines)
+
+                #apply BFI_INT if enabled
+                if bfi:
+                    #patch the binary output from the compiler
+                    patcher = BFIPatcher(self.interface)
+                    binaryData = patcher.patch(program.binaries[0])
+
+                    self.interface.debug('Applied BFI_INT patch')
+
+                    #reload the kernel with the patched binary
+                    program = cl.Program(
+                        context, [device],
+                        [binaryData]).build(defines)
+
+                #write the kernel binaries to file
+                binaryW = open(fileName, 'wb')
+                binaryW.write(program.binaries[0])
+                binaryW.close()
+            else:
+                binaryData = binary.read()
+                program = cl.Program(
+                    context, [device], [binaryData]).build(defines)
+
+        finally:
+            if binary: binary.close()
+
+        #unload the compiler to reduce memory usage
+        cl.unload_compiler()
+
+        return context, program
+
+    def kernelLoaded(self, result, rateDivisor):
+        """The program is built. Each stream switches over to it in its mining
+        thread, at the start of its next range.
+        """
+        self.context, self.kernel = result
+        self.programRateDivisor = rateDivisor
+        self.generation += 1
+
+    def kernelFailed(self, failure):
+        """The program could not be built, so there is nothing left to do."""
+        if failure.check(cl.LogicError):
+            self.interface.fatal('Failed to compile OpenCL kernel!')
+        elif failure.check(PatchError):
+            self.interface.fatal('Failed to apply BFI_INT patch to kernel! '
+                'Is BFI_INT supported on this hardware?')
+        else:
+            self.interface.fatal('Failed to load OpenCL kernel!')
+
+    def start(self):
+        """Phoenix wants the kernel to start."""
+
+        for stream in self.streams:
+            stream.qr.start()
+
+        # The first ranges can be fetched while the program is still building,
+        # but the mining threads have to wait for it.
+        def startThreads(ignored):
+            for stream in self.streams:
+                reactor.callInThread(self.mineThread, stream)
+        self.loaded.addCallback(startThreads)
+
+    def stop(self):
+        """Phoenix wants this kernel to stop. The kernel is not necessarily
+        reusable, so it's safe to clean up as well.
+        """
+        for stream in self.streams:
+            stream.qr.stop()
+
+    def updateIterations(self, stream):
+        # Set up the number of internal iterations to run if FASTLOOP enabled
+        rate = stream.core.getRate()
+
+        if not (rate <= 0):
+            #calculate the number of iterations to run
+            EXP = max(0, (math.log(rate)/math.log(2)) - (self.AGGRESSION - 8))
+            #prevent switching between loop exponent sizes constantly
+            if EXP > stream.loopExponent + 0.54:
+                EXP = round(EXP)
+            elif EXP < stream.loopExponent - 0.65:
+                EXP = round(EXP)
+            else:
+                EXP = stream.loopExponent
+
+            stream.loopExponent = int(max(0, EXP))
+
+    def preprocess(self, nr, stream):
+        if self.FASTLOOP:
+            self.updateIterations(stream)
+
+        # AGGRESSION may have been reduced since the stream's DutyCycle last
+        # shrank the executions, so they can't be allowed to get any smaller
+        # than the least AGGRESSION allows.
+        aggression = max(16, self.AGGRESSION - stream.duty.shift)
+
+        kd = self.KernelData(nr, stream.core, self.rateDivisor, aggression)
+        return kd
+
+    def postprocess(self, output, nr, stream):
+        # Scans over a single buffer produced as a result of running the
+        # OpenCL kernel on the device. This is done outside of the mining thread
+        # for efficiency reasons.
+
+        # Iterate over only the first OUTPUT_SIZE items. Exclude the last item
+        # which is a duplicate of the most recently-found nonce.
+        for i in xrange(self.OUTPUT_SIZE):
+            if output[i]:
+                if not self.interface.foundNonce(nr, int(output[i])):
+                    hash = self.interface.calculateHash(nr, int(output[i]))
+                    if not hash.endswith('\x00\x00\x00\x00'):
+                        self.interface.error('Unusual behavior from OpenCL. '
+                            'Hardware problem?')
+                        stream.core.reportHardwareError()
+
+                        # Don't act again while a new program is building.
+                        if self.loaded.called:
+                            self.errorPolicy.check()
+
+    def reduceAggression(self):
+        if self.AGGRESSION <= 16:
+            return False
+        self.interface.log('Too many hardware errors, reducing AGGRESSION')
+        self.AGGRESSION -= 1
+        self.size = 1 << self.AGGRESSION
+        for stream in self.streams:
+            stream.duty.maxShift = self.AGGRESSION - 16
+        return True
+
+    def disableBFI(self):
+        if not self.BFI_INT:
+            return False
+        self.interface.log('Too many hardware errors, disabling BFI_INT')
+        self.BFI_INT = False
+        self.buildProgram()
+        return True
+
+    def disableVectors(self):
+        if self.rateDivisor == 1:
+            return False
+        self.interface.log('Too many hardware errors, disabling vectors')
+        self.disableVectorOptions()
+        self.buildProgram()
+        return True
+
+    def disableVectorOptions(self):
+        """Turn off every option that makes work items check several nonces.
+        Kernels with more of these options extend this.
+        """
+        self.VECTORS = False
+
+    def rebuild(self):
+        self.interface.log('Too many hardware errors, rebuilding the program')
+        self.buildProgram(False)
+        return True
+
+    def failDevice(self):
+        self.interface.error('Too many hardware errors, giving up on '
+            'this device!')
+        self.stop()
+        return True
+
+    def mineThread(self, stream):
+        profile = self.PROFILE
+        paced = stream.duty.isActive()
+        timer = executionTime.labels(self.NAME)
+        for data in stream.qr:
+            # Switch to a new program if the kernel has been rebuilt, and redo
+            # ranges that were prepared for a program built differently.
+            if stream.generation != self.generation:
+                stream.load(self)
+            if data.rateDivisor != stream.rateDivisor:
+                data = self.KernelData(data.nr, stream.core,
+                    stream.rateDivisor, data.aggression)
+
+            # The arguments stay the same for the whole range, so they are only
+            # set once per range...
+            stream.search.set_args(*(data.arguments + (stream.output_buf,)))
+
+            for i in range(data.iterations):
+                # ...and each execution just moves the global offset along.
+                if paced:
+                    stream.duty.begin()
+                startedAt = time()
+                event = cl.enqueue_nd_range_kernel(
+                    stream.commandQueue, stream.search,
+                    (data.size, ), (self.WORKSIZE, ), (i * data.size, ))
+                cl.enqueue_read_buffer(
+                    stream.commandQueue, stream.output_buf, stream.output)
+                stream.commandQueue.finish()
+                timer.since(startedAt)
+
+                # The device's own timestamps leave out the host overhead
+                # between executions.
+                if profile:
+                    stream.qr.addDeviceTime(
+                        (event.profile.end - event.profile.start) * 1e-9)
+
+                # Leave the device idle for a while if it should only be
+                # busy part of the time.
+                if paced:
+                    stream.duty.end()
+
+                # The OpenCL code will flag the last item in the output buffer
+                # when it finds a valid nonce. If that's the case, send it to
+                # the main thread for postprocessing and clean the buffer
+                # for the next pass.
+                if stream.output[self.OUTPUT_SIZE]:
+                    reactor.callFromThread(self.postprocess,
+                    stream.output.copy(), data.nr, stream)
+
+                    stream.output.fill(0)
+                    cl.enqueue_write_buffer(
+                        stream.commandQueue, stream.output_buf, stream.output)
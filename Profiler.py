@@ -0,0 +1,252 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import sys
+import cProfile
+import threading
+from time import time, sleep, strftime
+from twisted.protocols.basic import LineReceiver
+from twisted.internet.protocol import Factory
+from twisted.python.threadable import isInIOThread
+
+class Profiler(object):
+    """Profiles Phoenix while it runs, so that profiling can be switched on
+    and off without restarting the miner.
+
+    There are two modes. Profiling traces every call with cProfile, for any
+    thread that asks for it: the reactor thread (called 'reactor') or the
+    mining threads, by name. Each thread writes its own .pstats file when it
+    stops. Sampling instead looks at the stacks of all threads every so often,
+    which is cheap enough to leave on, and writes the counts as collapsed
+    stacks (as used for flame graphs).
+
+    Mining threads only switch profiling on or off when they call poll(),
+    which QueueReaders do once per range.
+    """
+
+    REACTOR = 'reactor'
+    ALL = 'all'
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.targets = set()
+        self.profiles = {}
+        self.threads = set()
+        self.sampler = None
+
+    def _threadName(self):
+        if isInIOThread():
+            return self.REACTOR
+        return threading.currentThread().getName()
+
+    def _fileName(self, kind, name, extension):
+        name = name.replace(os.sep, '_')
+        return os.path.join(self.directory, '%s-%s-%s.%s' % (
+            kind, name, strftime('%Y%m%d-%H%M%S'), extension))
+
+    def isProfiling(self):
+        return bool(self.targets or self.profiles)
+
+    def start(self, thread=ALL):
+        """Start profiling a thread, or all of them. Called from the reactor
+        thread.
+        """
+        self.targets.add(thread)
+        self.poll()
+
+    def stop(self, thread=ALL):
+        """Stop profiling a thread, or all of them. Called from the reactor
+        thread.
+        """
+        if thread == self.ALL:
+            self.targets.clear()
+        else:
+            self.targets.discard(thread)
+        self.poll()
+
+    def toggle(self):
+        """Start profiling all threads, or stop all profiling."""
+        if self.isProfiling():
+            self.stop()
+        else:
+            self.start()
+
+    def poll(self):
+        """Start or stop profiling the calling thread, as it should be."""
+        name = self._threadName()
+        self.threads.add(name)
+        wanted = self.ALL in self.targets or name in self.targets
+        profile = self.profiles.get(name)
+        if wanted and profile is None:
+            profile = cProfile.Profile()
+            self.profiles[name] = profile
+            profile.enable()
+        elif not wanted and profile is not None:
+            self.release()
+
+    def release(self):
+        """Stop profiling the calling thread and write out what it collected.
+        Mining threads call this when they exit.
+        """
+        name = self._threadName()
+        self.threads.discard(name)
+        profile = self.profiles.pop(name, None)
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(self._fileName('profile', name, 'pstats'))
+
+    def startSampling(self, interval=0.01):
+        """Start sampling the stacks of all threads every interval seconds."""
+        if self.sampler is None:
+            self.sampler = Sampler(interval)
+            self.sampler.start()
+
+    def stopSampling(self):
+        """Stop sampling, and write out the stacks collected so far."""
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.dumpSamples()
+            self.sampler = None
+
+    def toggleSampling(self):
+        if self.sampler is None:
+            self.startSampling()
+        else:
+            self.stopSampling()
+
+    def dumpSamples(self):
+        """Write out the stacks sampled so far, returning the file name."""
+        if self.sampler is None:
+            return None
+        fileName = self._fileName('samples', 'all', 'folded')
+        self.sampler.dump(fileName)
+        return fileName
+
+    def shutdown(self):
+        """Write out everything that's still being collected."""
+        self.stop()
+        self.stopSampling()
+
+class Sampler(threading.Thread):
+    """Looks at what every thread is doing every so often, and counts the
+    stacks it sees.
+    """
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self, name='Sampler')
+        self.setDaemon(True)
+        self.interval = interval
+        self.running = True
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        me = threading.currentThread().ident
+        while self.running:
+            sleep(self.interval)
+            names = dict((t.ident, t.getName()) for t in threading.enumerate())
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s' % (
+                        os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                key = ';'.join(stack)
+                self.lock.acquire()
+                try:
+                    self.counts[key] = self.counts.get(key, 0) + 1
+                finally:
+                    self.lock.release()
+            del frames
+
+    def stop(self):
+        self.running = False
+
+    def dump(self, fileName):
+        self.lock.acquire()
+        try:
+            counts = self.counts.items()
+        finally:
+            self.lock.release()
+        f = open(fileName, 'w')
+        try:
+            for stack, count in sorted(counts):
+                f.write('%s %d\n' % (stack, count))
+        finally:
+            f.close()
+
+class ProfilerControl(LineReceiver):
+    """A line-based control connection for the Profiler. It understands:
+
+    profile start [THREAD]  - start profiling a thread (default: all)
+    profile stop [THREAD]   - stop profiling a thread (default: all)
+    sample start [INTERVAL] - start sampling every INTERVAL seconds
+    sample stop             - stop sampling and write out the stacks
+    sample dump             - write out the stacks sampled so far
+    threads                 - list the threads that can be profiled
+    """
+
+    delimiter = '\n'
+
+    def lineReceived(self, line):
+        args = line.strip().split()
+        profiler = self.factory.profiler
+        try:
+            if args[:2] == ['profile', 'start'] and len(args) <= 3:
+                profiler.start(*args[2:])
+            elif args[:2] == ['profile', 'stop'] and len(args) <= 3:
+                profiler.stop(*args[2:])
+            elif args[:2] == ['sample', 'start'] and len(args) <= 3:
+                profiler.startSampling(*[float(x) for x in args[2:]])
+            elif args == ['sample', 'stop']:
+                profiler.stopSampling()
+            elif args == ['sample', 'dump']:
+                fileName = profiler.dumpSamples()
+                if fileName is None:
+                    self.sendLine('ERROR not sampling')
+                    return
+                self.sendLine('OK %s' % fileName)
+                return
+            elif args == ['threads']:
+                self.sendLine('OK %s' % ' '.join(sorted(profiler.threads |
+                    set([Profiler.REACTOR]))))
+                return
+            else:
+                self.sendLine('ERROR unknown command')
+                return
+        except ValueError:
+            self.sendLine('ERROR invalid argument')
+            return
+        self.sendLine('OK')
+
+class ProfilerControlFactory(Factory):
+    protocol = ProfilerControl
+
+    def __init__(self, profiler):
+        self.profiler = profiler
@@ -23,8 +23,14 @@ from time import time
 from Queue import Queue, Empty
 from twisted.internet import reactor, defer
 
+from minerutil.Metrics import registry
 from KernelInterface import CoreInterface
 
+blockTime = registry.timer('phoenix_queuereader_block_seconds',
+    'Time mining threads waited for their next range.')
+preprocessTime = registry.timer('phoenix_queuereader_preprocess_seconds',
+    'Time spent preprocessing nonce ranges for the kernel.')
+
 class QueueReader(object):
     """A QueueReader is a very efficient WorkQueue reader that keeps the next
     nonce range available at all times. The benefit is that threaded mining
@@ -45,6 +51,7 @@ class QueueReader(object):
             core = core.addCore()
         self.core = core
         self.interface = core.getKernelInterface()
+        self.profiler = self.interface.miner.profiler
         self.preprocessor = preprocessor
         self.workSizeCallback = workSizeCallback
 
@@ -68,6 +75,7 @@ class QueueReader(object):
         # Statistics accessed by the dedicated thread.
         self.currentData = None
         self.startedAt = None
+        self.deviceTime = None
 
     def start(self):
         """Called by the kernel when it's actually starting."""
@@ -88,14 +96,31 @@ class QueueReader(object):
                 pass
         self.dataQueue.put(StopIteration())
 
-    def _ranExecution(self, dt, nr):
+    def addDeviceTime(self, dt):
+        """Called from the dedicated thread by kernels that can measure how
+        long the device itself spent on (part of) the current range, such as
+        through OpenCL profiling events. When available, this is used in place
+        of the wall-clock time for the rate and for tuning.
+        """
+        self.deviceTime = (self.deviceTime or 0) + dt
+
+    def _ranExecution(self, dt, nr, deviceTime=None):
         """An internal function called after an execution completes, with the
         time it took. Used to keep track of the time so kernels can use it to
         tune their execution times.
         """
 
+        # The wall-clock time also includes the host's turnaround, waiting
+        # for the GIL, reactor scheduling and so on. If the device timed the
+        # range itself, keep the two apart.
+        if deviceTime is not None:
+            self.core.updateTiming(deviceTime, max(0, dt - deviceTime))
+            dt = deviceTime
+
+        self.core.reportNonces(nr.size)
+
         if dt > 0:
-            self.core.updateRate(int(nr.size/dt/1000))
+            self.core.reportExecution(nr.size, dt)
 
         self.executionTimeSamples.append(dt)
         self.executionTimeSamples = self.executionTimeSamples[-self.SAMPLES:]
@@ -133,10 +158,12 @@ class QueueReader(object):
             if not self.preprocessor:
                 return (nr, nr)
 
+            startedAt = time()
             d2 = defer.maybeDeferred(self.preprocessor, nr)
 
             # Tuplize the preprocessed result.
             def callback(x):
+                preprocessTime.since(startedAt)
                 return (x, nr)
             d2.addCallback(callback)
             return d2
@@ -170,23 +197,36 @@ class QueueReader(object):
         main thread.
         """
 
+        # Profiling is switched on and off between ranges.
+        self.profiler.poll()
+
         # If we just completed a range, we should tell the main thread.
         now = time()
         if self.currentData:
             dt = now - self.startedAt
             # self.currentData[1] is the un-preprocessed NonceRange.
-            reactor.callFromThread(self._ranExecution, dt, self.currentData[1])
+            reactor.callFromThread(self._ranExecution, dt, self.currentData[1],
+                self.deviceTime)
         self.startedAt = now
+        self.deviceTime = None
 
         # Block for more data from the main thread. In 99% of cases, though,
         # there should already be something here.
         # Note that this comes back with either a tuple, or a StopIteration()
+        waitingSince = time()
         self.currentData = self.dataQueue.get(True)
+        blockTime.since(waitingSince)
 
         # Does the main thread want us to shut down, or pass some more data?
         if isinstance(self.currentData, StopIteration):
+            self.profiler.release()
             raise self.currentData
 
+        # The WorkQueue belongs to the main thread, so this is passed over
+        # along with the time the range was started.
+        reactor.callFromThread(self.interface.miner.queue.rangeStarted,
+            self.currentData[1], time())
+
         # We just took the only item in the queue. It needs to be restocked.
         reactor.callFromThread(self._requestMore)
 
@@ -19,10 +19,24 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+from time import time
+from struct import unpack
 from minerutil.Midstate import calculateMidstate
+from minerutil.Metrics import registry
 from twisted.internet import defer
 from collections import deque
 
+workUnits = registry.counter('phoenix_work_units_total',
+    'Work units received from the server.')
+blocks = registry.counter('phoenix_blocks_total', 'New blocks seen.')
+nonceRanges = registry.counter('phoenix_nonce_ranges_total',
+    'Nonce ranges handed out to kernels.')
+emptyFetches = registry.counter('phoenix_queue_empty_total',
+    'Requests for nonce ranges that had to wait for work.')
+newWorkTime = registry.timer('phoenix_new_work_to_device_seconds',
+    'Time from work for a new block (e.g. a long poll push) arriving to a '
+    'mining thread starting on it.')
+
 """A WorkUnit is a single unit containing 2^32 nonces. A single getWork
 request returns a WorkUnit.
 """
@@ -65,6 +79,14 @@ class WorkQueue(object):
         self.currentUnit = None
         self.block = ''
         self.lastBlock = None
+        self.newWork = None
+
+        registry.gauge('phoenix_queue_work_units',
+            'Work units waiting in the WorkQueue.',
+            lambda: len(self.queue) + (self.currentUnit is not None))
+        registry.gauge('phoenix_queue_waiting_requests',
+            'Requests for nonce ranges waiting for work.',
+            lambda: len(self.deferredQueue))
 
         # This is set externally. Not the best practice, but it can be changed
         # in the future.
@@ -74,6 +96,16 @@ class WorkQueue(object):
     def isRangeStale(self, nr):
         return (nr.unit.identifier != self.block)
 
+    def rangeStarted(self, nr, startedAt):
+        """Called (in the main thread) when a mining thread has started on a
+        range, to measure how long work for a new block took to reach the
+        device.
+        """
+        newWork = self.newWork
+        if newWork is not None and nr.unit.identifier == newWork[0]:
+            self.newWork = None
+            newWorkTime.observe(startedAt - newWork[1])
+
     def storeWork(self, aw):
 
         #check if this work matches the previous block
@@ -85,13 +117,18 @@ class WorkQueue(object):
                 self.miner.connection.requestWork()
             return
 
+        workUnits.inc()
+
         #create a WorkUnit
         work = WorkUnit()
         work.data = aw.data
         work.target = aw.target
         work.midstate = calculateMidstate(work.data[:64])
-        work.nonces = 2 ** aw.mask
-        work.base = 0
+        #work that covers less than all 2^32 nonces has the nonces that the
+        #mask doesn't cover fixed by the nonce in the data
+        size = 2 ** aw.mask
+        work.base = unpack('<I', aw.data[76:80])[0] & -size
+        work.nonces = work.base + size
         work.identifier = aw.identifier
 
         #check if there is a new block, if so reset queue
@@ -102,6 +139,8 @@ class WorkQueue(object):
             self.lastBlock = self.block
             self.block = aw.identifier
             self.logger.reportDebug("New block (WorkQueue)")
+            self.newWork = (aw.identifier, time())
+            blocks.inc()
 
         #clear the idle flag since we just added work to queue
         self.miner.reportIdle(False)
@@ -158,6 +197,8 @@ class WorkQueue(object):
                 self.currentUnit, self.currentUnit.base, noncesLeft)
             self.currentUnit = None
 
+        nonceRanges.inc()
+
         #return the range
         return nr
 
@@ -200,6 +241,7 @@ class WorkQueue(object):
 
                 #report that the miner is idle
                 self.miner.reportIdle(True)
+                emptyFetches.inc()
 
                 #set up and return deferred
                 df = defer.Deferred()
@@ -0,0 +1,396 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""A stand-in for a mining pool, for testing Phoenix's networking without a
+live one. It serves getwork over HTTP (with long polling, X-Roll-NTime and
+X-Reject-Reason) and MMP, checks the results it gets back, and can be told to
+add latency, fail requests, change blocks and drop connections.
+
+It can run on its own, for pointing a real Phoenix at:
+
+    python benchmarks/PoolSimulator.py --http 8332 --mmp 8880 --block 60
+
+...or be set up by scenario.py, in the same process as the Miner.
+"""
+
+import os
+import sys
+import json
+import random
+from time import time
+from struct import pack, unpack
+from hashlib import sha256
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet import reactor, task
+from twisted.internet.protocol import Factory
+from twisted.web import server, resource
+
+from minerutil.MMPProtocol import MMPServerProtocol
+
+def makeTarget(zeroBits):
+    """Return a target that a hash meets if it ends in zeroBits zero bits."""
+    target = (1 << (256 - zeroBits)) - 1
+    return ''.join(chr((target >> (8*i)) & 0xFF) for i in range(32))
+
+class SimulatedPool(object):
+    """The pool itself: hands out work, checks results, and keeps count of
+    what happened. The faults it injects can be changed at any time.
+    """
+
+    def __init__(self, zeroBits=8, rollNTime=0, latency=0.0, jitter=0.0,
+        errors=0.0):
+        self.target = makeTarget(zeroBits)
+        self.rollNTime = rollNTime
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+
+        self.block = 0
+        self.prevHash = None
+        self.issued = {}
+        self.submitted = set()
+        self.blockCallbacks = []
+        self.disconnectCallbacks = []
+
+        self.stats = {'work': 0, 'accepted': 0, 'rejected': 0, 'stale': 0,
+            'errors': 0, 'blocks': 0, 'disconnects': 0}
+
+        self.blockCall = None
+        self.disconnectCall = None
+
+        self.newBlock(False)
+
+    def delay(self):
+        """How long to hold a response back for."""
+        return self.latency + random.random()*self.jitter
+
+    def later(self, f, *args):
+        """Run f after the simulated latency."""
+        reactor.callLater(self.delay(), f, *args)
+
+    def shouldFail(self):
+        if random.random() < self.errors:
+            self.stats['errors'] += 1
+            return True
+        return False
+
+    def getWork(self):
+        """Return 80 bytes of new work for the current block, in the same
+        byte order as getwork and MMP send it.
+        """
+        now = int(time())
+        merkle = os.urandom(32)
+        # Each word of the header is byteswapped, the same as real getwork.
+        data = (pack('>I', 1) + self.prevHash + merkle +
+            pack('>II', now, 0x1d00ffff) + '\x00'*4)
+        self.issued[data[:68]] = now
+        self.stats['work'] += 1
+        return data
+
+    def checkResult(self, data):
+        """Check a result, returning None if it's accepted, or else the reason
+        it isn't.
+        """
+        if len(data) < 80:
+            return 'invalid'
+        data = data[:80]
+        issuedAt = self.issued.get(data[:68])
+        if issuedAt is None:
+            if data[4:36] != self.prevHash:
+                self.stats['stale'] += 1
+                return 'stale'
+            return 'unknown-work'
+
+        ntime, = unpack('>I', data[68:72])
+        if not issuedAt <= ntime <= issuedAt + self.rollNTime:
+            return 'time-invalid'
+
+        if data in self.submitted:
+            return 'duplicate'
+
+        # Getwork data is the block header with each word byteswapped.
+        header = pack('>20I', *unpack('<20I', data))
+        hash = sha256(sha256(header).digest()).digest()
+        if hash[::-1] > self.target[::-1]:
+            return 'high-hash'
+
+        self.submitted.add(data)
+        return None
+
+    def submit(self, data):
+        """Check a result and count the outcome."""
+        reason = self.checkResult(data)
+        if reason is None:
+            self.stats['accepted'] += 1
+        else:
+            self.stats['rejected'] += 1
+        return reason
+
+    def newBlock(self, notify=True):
+        """Move on to a new block, making all work given out so far stale."""
+        self.block += 1
+        self.prevHash = os.urandom(32)
+        self.issued = {}
+        self.submitted = set()
+        if notify:
+            self.stats['blocks'] += 1
+            for callback in list(self.blockCallbacks):
+                callback()
+
+    def disconnect(self):
+        """Drop every connection."""
+        self.stats['disconnects'] += 1
+        for callback in list(self.disconnectCallbacks):
+            callback()
+
+    def setBlockInterval(self, interval):
+        """Change blocks every interval seconds, or stop doing so if None."""
+        if self.blockCall and self.blockCall.running:
+            self.blockCall.stop()
+        if interval:
+            self.blockCall = task.LoopingCall(self.newBlock)
+            self.blockCall.start(interval, False)
+
+    def setDisconnectInterval(self, interval):
+        """Drop all connections every interval seconds, or stop doing so if
+        None.
+        """
+        if self.disconnectCall and self.disconnectCall.running:
+            self.disconnectCall.stop()
+        if interval:
+            self.disconnectCall = task.LoopingCall(self.disconnect)
+            self.disconnectCall.start(interval, False)
+
+class GetworkResource(resource.Resource):
+    """Serves getwork requests and results, and the long poll URL."""
+
+    isLeaf = True
+
+    LONGPOLL_PATH = '/LP'
+
+    def __init__(self, pool):
+        resource.Resource.__init__(self)
+        self.pool = pool
+        self.longPolls = []
+        self.requests = set()
+        pool.blockCallbacks.append(self.pushWork)
+        pool.disconnectCallbacks.append(self.dropConnections)
+
+    def setHeaders(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        request.setHeader('X-Long-Polling', self.LONGPOLL_PATH)
+        request.setHeader('X-Blocknum', str(self.pool.block))
+        if self.pool.rollNTime:
+            request.setHeader('X-Roll-NTime',
+                'expire=%d' % self.pool.rollNTime)
+
+    def workResult(self):
+        data = self.pool.getWork()
+        # Getwork pads the data out to a full SHA-256 block.
+        data += '\x00\x00\x00\x80' + '\x00'*40 + '\x80\x02\x00\x00'
+        return {'data': data.encode('hex'),
+            'target': self.pool.target.encode('hex')}
+
+    def respond(self, request, result=None, error=None, reason=None):
+        if request.finished or request._disconnected:
+            return
+        self.requests.discard(request)
+        self.setHeaders(request)
+        if reason is not None:
+            request.setHeader('X-Reject-Reason', reason)
+        if error is not None:
+            error = {'code': -1, 'message': error}
+        request.write(json.dumps(
+            {'result': result, 'error': error, 'id': 1}))
+        request.finish()
+
+    def render_GET(self, request):
+        if request.path != self.LONGPOLL_PATH:
+            request.setResponseCode(404)
+            return ''
+        self.longPolls.append(request)
+        request.notifyFinish().addErrback(
+            lambda ignored: self.forget(request))
+        return server.NOT_DONE_YET
+
+    def render_POST(self, request):
+        try:
+            call = json.loads(request.content.read())
+            params = call.get('params') or []
+        except (ValueError, AttributeError):
+            request.setResponseCode(400)
+            return ''
+
+        self.requests.add(request)
+        request.notifyFinish().addErrback(
+            lambda ignored: self.requests.discard(request))
+
+        if self.pool.shouldFail():
+            self.pool.later(self.respond, request, None, 'Simulated error')
+        elif params:
+            try:
+                data = params[0].decode('hex')
+            except (TypeError, ValueError, AttributeError):
+                data = ''
+            reason = self.pool.submit(data)
+            self.pool.later(self.respond, request, reason is None, None,
+                reason)
+        else:
+            self.pool.later(self.respond, request, self.workResult())
+        return server.NOT_DONE_YET
+
+    def forget(self, request):
+        if request in self.longPolls:
+            self.longPolls.remove(request)
+
+    def pushWork(self):
+        longPolls, self.longPolls = self.longPolls, []
+        for request in longPolls:
+            self.pool.later(self.respond, request, self.workResult())
+
+    def dropConnections(self):
+        longPolls, self.longPolls = self.longPolls, []
+        for request in longPolls + list(self.requests):
+            request.transport.loseConnection()
+        self.requests = set()
+
+class SimulatedMMPProtocol(MMPServerProtocol):
+    """One MMP client's connection to the simulated pool."""
+
+    def connectionMade(self):
+        MMPServerProtocol.connectionMade(self)
+        self.factory.clients.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.clients.discard(self)
+
+    def sendLine(self, line):
+        self.factory.pool.later(self.sendLater, line)
+
+    def sendLater(self, line):
+        if self.transport.connected:
+            MMPServerProtocol.sendLine(self, line)
+
+    def sendNewWork(self):
+        self.sendWork(self.factory.pool.getWork(), self.getMask())
+
+    def loginAccepted(self):
+        pool = self.factory.pool
+        self.sendTarget(pool.target)
+        self.sendTime(pool.rollNTime)
+        self.sendBlock(pool.block)
+        self.sendNewWork()
+
+    def workRequested(self):
+        if self.factory.pool.shouldFail():
+            self.sendMessage('Simulated error')
+        else:
+            self.sendNewWork()
+
+    def resultReceived(self, data):
+        if self.factory.pool.shouldFail():
+            reason = 'error'
+        else:
+            reason = self.factory.pool.submit(data)
+        self.answerResult(data, reason is None)
+
+    def newBlock(self):
+        if self.loggedIn:
+            self.sendBlock(self.factory.pool.block)
+            self.sendNewWork()
+
+class SimulatedMMPFactory(Factory):
+    protocol = SimulatedMMPProtocol
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.clients = set()
+        pool.blockCallbacks.append(self.newBlock)
+        pool.disconnectCallbacks.append(self.dropConnections)
+
+    def newBlock(self):
+        for client in self.clients:
+            client.newBlock()
+
+    def dropConnections(self):
+        for client in list(self.clients):
+            client.transport.loseConnection()
+
+def listen(pool, httpPort=None, mmpPort=None, interface='127.0.0.1'):
+    """Start serving the pool. Returns the listening ports."""
+    ports = []
+    if httpPort is not None:
+        site = server.Site(GetworkResource(pool))
+        site.noisy = False
+        ports.append(reactor.listenTCP(httpPort, site, interface=interface))
+    if mmpPort is not None:
+        factory = SimulatedMMPFactory(pool)
+        factory.noisy = False
+        ports.append(reactor.listenTCP(mmpPort, factory, interface=interface))
+    return ports
+
+def addOptions(parser):
+    """Add the options that set up a SimulatedPool."""
+    parser.add_option('--zerobits', dest='zerobits', type='int', default=8,
+        help='how many zero bits the target requires at the end of a hash')
+    parser.add_option('--rollntime', dest='rollntime', type='int', default=0,
+        help='how far clients may roll ntime, in seconds')
+    parser.add_option('--latency', dest='latency', type='float', default=0.0,
+        help='seconds to hold back every response')
+    parser.add_option('--jitter', dest='jitter', type='float', default=0.0,
+        help='up to how many more seconds to hold back every response')
+    parser.add_option('--errors', dest='errors', type='float', default=0.0,
+        help='the probability of a request failing')
+    parser.add_option('--block', dest='block', type='float', default=None,
+        help='change blocks every this many seconds')
+    parser.add_option('--disconnect', dest='disconnect', type='float',
+        default=None, help='drop all connections every this many seconds')
+
+def makePool(settings):
+    pool = SimulatedPool(settings.zerobits, settings.rollntime,
+        settings.latency, settings.jitter, settings.errors)
+    pool.setBlockInterval(settings.block)
+    pool.setDisconnectInterval(settings.disconnect)
+    return pool
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--http', dest='http', type='int', default=8332,
+        help='the port to serve getwork on')
+    parser.add_option('--mmp', dest='mmp', type='int', default=8880,
+        help='the port to serve MMP on')
+    addOptions(parser)
+    settings, args = parser.parse_args()
+
+    pool = makePool(settings)
+    listen(pool, settings.http, settings.mmp, '')
+
+    def report():
+        print ' '.join('%s=%d' % item for item in sorted(pool.stats.items()))
+    task.LoopingCall(report).start(10, False)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
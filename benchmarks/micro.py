@@ -0,0 +1,345 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Microbenchmarks for the code Phoenix runs per range and per share, for
+spotting regressions between commits.
+
+    python benchmarks/micro.py [-b NAME] [-o results.json] [-c baseline.json]
+
+Each benchmark is timed in several rounds, long enough to be stable, and the
+fastest round is what counts. Results are printed in microseconds per call,
+and can be saved as JSON and compared against an earlier run. Benchmarks that
+can't run here (e.g. because pyopencl is missing) are reported as skipped.
+"""
+
+import os
+import imp
+import sys
+import json
+import timeit
+import platform
+import subprocess
+import numpy as np
+from struct import pack, unpack
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from twisted.internet import reactor, defer
+
+from minerutil.Midstate import calculateMidstate
+from minerutil.ClientBase import AssignedWork
+from minerutil.MMPProtocol import MMPProtocolBase, MMPServerProtocol
+from minerutil.RPCProtocol import RPCPoller
+from minerutil.Metrics import Counter, Timer
+from KernelInterface import KernelInterface
+from QueueReader import QueueReader
+from WorkQueue import WorkQueue, NonceRange
+from Miner import Miner
+from pipeline import QuietLogger
+
+# The data used throughout: some getwork data with the nonce cleared.
+DATA = ('0100000081cd02ab7e569e8bcd9317e2fe99f2de44d49ab2b8851ba4a3080000000'
+    '00000e320b6c2fffc8d750423db8b1eb942ae710e951ed797f7affc8892b0f1fc122bc7'
+    'f5d74df2b9441a00000000').decode('hex')
+DATA = pack('>20I', *unpack('<20I', DATA))
+MIDSTATE = calculateMidstate(DATA[:64])
+EASY_TARGET = '\xff'*32
+
+class BenchmarkConnection(object):
+    """Gives out the same work whenever it's told to, and accepts every
+    result.
+    """
+
+    def __init__(self, miner):
+        self.miner = miner
+
+    def storeWork(self):
+        aw = AssignedWork()
+        aw.data = DATA
+        aw.target = EASY_TARGET
+        aw.mask = 32
+        aw.identifier = DATA[4:36]
+        self.miner.queue.storeWork(aw)
+
+    def requestWork(self):
+        # A real server would answer later; the benchmarks store more work
+        # themselves when the queue runs out.
+        pass
+
+    def sendResult(self, result):
+        return defer.succeed(True)
+
+    def setMeta(self, var, value):
+        pass
+
+class BenchmarkOptions(object):
+    kernelOptions = {}
+    def getQueueSize(self):
+        return 1
+    def getAvgSamples(self):
+        return 10
+    def makeLogger(self, requester, miner):
+        return QuietLogger()
+
+def makeMiner():
+    """Set up a Miner with a WorkQueue that never runs dry, without a kernel
+    or a real connection.
+    """
+    miner = Miner()
+    miner.options = BenchmarkOptions()
+    miner.logger = QuietLogger()
+    miner.connection = BenchmarkConnection(miner)
+    miner.queue = WorkQueue(miner, miner.options)
+    miner.connection.storeWork()
+    return miner
+
+def makeNonceRange(size=0x100000):
+    miner = makeMiner()
+    nr = []
+    miner.queue.fetchRange(size).addCallback(nr.append)
+    return nr[0]
+
+def loadKernel(name):
+    file, filename, smt = imp.find_module(name, [os.path.join(ROOT, 'kernels')])
+    return imp.load_module('bench_' + name, file, filename, smt)
+
+# Each benchmark returns the function to time. Benchmarks are listed in the
+# order they run.
+BENCHMARKS = []
+def benchmark(name):
+    def register(f):
+        BENCHMARKS.append((name, f))
+        return f
+    return register
+
+@benchmark('calculateMidstate')
+def benchMidstate():
+    return lambda: calculateMidstate(DATA[:64])
+
+def makeKernelDataBenchmark(name):
+    @benchmark('%s.KernelData' % name)
+    def benchKernelData():
+        kernel = loadKernel(name)
+        nr = makeNonceRange()
+        if name == 'cpu':
+            return lambda: kernel.KernelData(nr)
+        return lambda: kernel.KernelData(nr, None, 1, 20)
+
+    @benchmark('%s.calculateF' % name)
+    def benchCalculateF():
+        kernel = loadKernel(name)
+        nr = makeNonceRange()
+        if name == 'cpu':
+            kd = kernel.KernelData(nr)
+            data = kd.data
+        else:
+            kd = kernel.KernelData(nr, None, 1, 20)
+            data = np.array(unpack('IIII', nr.unit.data[64:]), dtype=np.uint32)
+        return lambda: kd.calculateF(data)
+
+    if name == 'cpu':
+        return
+
+    @benchmark('%s.getArguments' % name)
+    def benchGetArguments():
+        # The search kernel's arguments are built once per range; before
+        # that, every execution paid for this.
+        kernel = loadKernel(name)
+        kd = kernel.KernelData(makeNonceRange(), None, 1, 20)
+        return kd.getArguments
+
+for name in ('phatk', 'phatk2', 'poclbm', 'cpu'):
+    makeKernelDataBenchmark(name)
+
+@benchmark('KernelInterface.calculateHash')
+def benchCalculateHash():
+    interface = KernelInterface(makeMiner())
+    nr = makeNonceRange()
+    return lambda: interface.calculateHash(nr, 0x12345678)
+
+@benchmark('KernelInterface.checkTarget')
+def benchCheckTarget():
+    interface = KernelInterface(makeMiner())
+    nr = makeNonceRange()
+    hash = interface.calculateHash(nr, 0x12345678)
+    return lambda: interface.checkTarget(hash, EASY_TARGET)
+
+@benchmark('KernelInterface.foundNonce')
+def benchFoundNonce():
+    interface = KernelInterface(makeMiner())
+    nr = makeNonceRange()
+    return lambda: interface.foundNonce(nr, 0x12345678)
+
+def makeFetchRangeBenchmark(exponent):
+    @benchmark('WorkQueue.fetchRange(2^%d)' % exponent)
+    def benchFetchRange():
+        miner = makeMiner()
+        queue = miner.queue
+        def fetchRange():
+            if queue.currentUnit is None and not queue.queue:
+                miner.connection.storeWork()
+            queue.fetchRange(1 << exponent)
+        return fetchRange
+
+for exponent in (16, 20, 24, 28):
+    makeFetchRangeBenchmark(exponent)
+
+@benchmark('QueueReader.next')
+def benchQueueReader():
+    # Both sides of the QueueReader run in this thread: the reactor's share
+    # of the work is done by running what the "mining thread" queued up.
+    miner = makeMiner()
+    queue = miner.queue
+    interface = KernelInterface(miner)
+    qr = QueueReader(interface.addCore(), None, lambda t, size: 0x100000)
+    qr.start()
+    def next():
+        if queue.currentUnit is None and not queue.queue:
+            miner.connection.storeWork()
+        qr.next()
+        reactor.runUntilCurrent()
+    return next
+
+class BenchmarkMMPProtocol(MMPProtocolBase):
+    commands = {
+        'WORK':     (str, int),
+        'ACCEPTED': (str,),
+        'MSG':      (str,),
+    }
+    def cmd_WORK(self, work, mask): pass
+    def cmd_ACCEPTED(self, data): pass
+    def cmd_MSG(self, message): pass
+
+def makeLineBenchmark(command, line):
+    @benchmark('MMPProtocolBase.lineReceived(%s)' % command)
+    def benchLineReceived():
+        protocol = BenchmarkMMPProtocol()
+        return lambda: protocol.lineReceived(line)
+
+makeLineBenchmark('WORK', 'WORK %s 32' % DATA.encode('hex'))
+makeLineBenchmark('ACCEPTED', 'ACCEPTED %s' % DATA.encode('hex'))
+makeLineBenchmark('MSG', 'MSG :Welcome to the pool, have fun mining')
+
+@benchmark('MMPServerProtocol.lineReceived(RESULT)')
+def benchResultReceived():
+    # What a proxy goes through for every share from its miners.
+    protocol = MMPServerProtocol()
+    protocol.loggedIn = True
+    line = 'RESULT %s' % DATA.encode('hex')
+    return lambda: protocol.lineReceived(line)
+
+@benchmark('RPCPoller.parse')
+def benchParse():
+    response = json.dumps({'result': {
+        'data': (DATA + '\x00\x00\x00\x80' + '\x00'*40 +
+            '\x80\x02\x00\x00').encode('hex'),
+        'target': EASY_TARGET.encode('hex'),
+        'midstate': MIDSTATE.encode('hex'),
+        'hash1': ('00'*32 + '0000008' + '0'*97 + '1000000'),
+        }, 'error': None, 'id': 1})
+    return lambda: RPCPoller.parse(response)
+
+@benchmark('Counter.inc')
+def benchCounter():
+    return Counter('benchmark_total', '').inc
+
+@benchmark('Timer.observe')
+def benchTimer():
+    timer = Timer('benchmark_seconds', '')
+    return lambda: timer.observe(0.02)
+
+def measure(f, rounds, minTime):
+    """Time f, returning the fastest and median time per call of several
+    rounds, each running for at least minTime.
+    """
+    timer = timeit.Timer(f)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= minTime:
+            break
+        number *= max(2, min(10, int(minTime / max(elapsed, 1e-9))))
+    times = sorted(timer.repeat(rounds, number))
+    return {'usec': 1e6 * times[0] / number,
+        'median': 1e6 * times[len(times)/2] / number,
+        'number': number}
+
+def getCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], cwd=ROOT, stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-b', '--benchmark', dest='benchmark', default=None,
+        help='only run benchmarks with this in their name')
+    parser.add_option('-r', '--rounds', dest='rounds', type='int', default=5,
+        help='how many rounds to time each benchmark for')
+    parser.add_option('-t', '--time', dest='time', type='float', default=0.2,
+        help='the least time each round should take, in seconds')
+    parser.add_option('-o', '--output', dest='output', default=None,
+        help='save the results as JSON to this file')
+    parser.add_option('-c', '--compare', dest='compare', default=None,
+        help='compare against results saved earlier')
+    settings, args = parser.parse_args()
+
+    baseline = {}
+    if settings.compare:
+        baseline = json.load(open(settings.compare))['benchmarks']
+
+    results = {}
+    for name, setup in BENCHMARKS:
+        if settings.benchmark and settings.benchmark not in name:
+            continue
+        try:
+            f = setup()
+        except ImportError, e:
+            results[name] = {'skipped': str(e)}
+            print '%-45s skipped (%s)' % (name, e)
+            continue
+
+        result = measure(f, settings.rounds, settings.time)
+        results[name] = result
+        line = '%-45s %12.3f usec' % (name, result['usec'])
+        old = baseline.get(name, {}).get('usec')
+        if old:
+            line += '  %+7.1f%%' % (100 * (result['usec'] - old) / old)
+        print line
+
+    if settings.output:
+        output = {
+            'commit': getCommit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'benchmarks': results,
+        }
+        f = open(settings.output, 'w')
+        json.dump(output, f, indent=2, sort_keys=True)
+        f.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Measures how fast Phoenix itself can move work between the server and a
+kernel: the WorkQueue, the QueueReaders, the hops between the reactor and the
+mining threads and the path a share takes to the connection. This runs the
+real Miner with the null kernel and a connection that hands out work and takes
+results instantly, so the host side is the only thing being measured.
+
+Without -r, the null kernel goes as fast as it can, giving the most ranges per
+second Phoenix can sustain. With -r, compare the achieved rate to the one
+requested to see where the host side becomes the bottleneck.
+"""
+
+import os
+import imp
+import sys
+import struct
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet import reactor, defer, task
+
+from minerutil.ClientBase import AssignedWork
+from WorkQueue import WorkQueue
+from Miner import Miner
+
+def makeTarget(zeroBits):
+    """Return a target that a hash meets if it ends in zeroBits zero bits."""
+    target = (1 << (256 - zeroBits)) - 1
+    return ''.join(chr((target >> (8*i)) & 0xFF) for i in range(32))
+
+class Samples(object):
+    """Collects latency samples and summarizes them."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, sample):
+        self.samples.append(sample)
+
+    def summary(self):
+        if not self.samples:
+            return 'no samples'
+        samples = sorted(self.samples)
+        pick = lambda p: samples[min(len(samples)-1, int(len(samples)*p))]
+        return ('n=%d mean=%.3fms p50=%.3fms p99=%.3fms max=%.3fms' %
+            (len(samples), 1000*sum(samples)/len(samples), 1000*pick(0.5),
+            1000*pick(0.99), 1000*samples[-1]))
+
+class LocalConnection(object):
+    """Stands in for the connection to the server. It gives out new work as
+    soon as it's asked for, and accepts every result.
+    """
+
+    def __init__(self, handler, target):
+        self.handler = handler
+        self.target = target
+        self.pending = False
+        self.units = 0
+        self.accepted = 0
+        self.sharePath = Samples()
+
+    def connect(self):
+        self.handler.onConnect()
+        self.requestWork()
+
+    def disconnect(self):
+        pass
+
+    def setMeta(self, var, value):
+        pass
+
+    def setVersion(self, shortname, longname=None, version=None, author=None):
+        pass
+
+    def requestWork(self):
+        if not self.pending:
+            self.pending = True
+            reactor.callLater(0, self._sendWork)
+
+    def _sendWork(self):
+        self.pending = False
+        self.units += 1
+        aw = AssignedWork()
+        aw.data = os.urandom(80)
+        aw.target = self.target
+        aw.mask = 32
+        aw.setMaxTimeIncrement(0)
+        aw.identifier = 'benchmark'
+        self.handler.onWork(aw)
+
+    def sendResult(self, result):
+        foundAt = self.handler.kernel.foundAt
+        if foundAt is not None:
+            self.sharePath.add(time() - foundAt)
+        self.accepted += 1
+        return defer.succeed(True)
+
+class QuietLogger(object):
+    """Stands in for the ConsoleLogger, only passing on kernel errors."""
+
+    def reportRate(self, rate, update=True): pass
+    def reportType(self, type): pass
+    def reportBlock(self, block): pass
+    def reportFound(self, hash, accepted): pass
+    def reportMsg(self, message): pass
+    def reportConnected(self, connected): pass
+    def reportConnectionFailed(self): pass
+    def reportDebug(self, message): pass
+    def updateStatus(self, force=False): pass
+
+    def log(self, message, update=True, hideTimestamp=False):
+        print message
+
+class CountingWorkQueue(WorkQueue):
+    """A WorkQueue that counts the ranges it hands out."""
+
+    def __init__(self, miner, options):
+        WorkQueue.__init__(self, miner, options)
+        self.ranges = 0
+
+    def fetchRange(self, size=0x10000):
+        self.ranges += 1
+        return WorkQueue.fetchRange(self, size)
+
+class BenchmarkOptions(object):
+    """Implements the Options interface for the benchmark."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.logger = QuietLogger()
+        self.kernel = None
+        self.queue = None
+        self.url2 = None
+        self.kernelOptions = {
+            'RATE': str(settings.rate),
+            'SHARES': str(settings.shares),
+            'CORES': str(settings.cores),
+            'SIZE': str(settings.size),
+        }
+
+    def getQueueSize(self):
+        return 1
+    def getAvgSamples(self):
+        return 10
+
+    def makeLogger(self, requester, miner):
+        return self.logger
+
+    def makeConnection(self, requester, backup=False):
+        return LocalConnection(requester, makeTarget(self.settings.zerobits))
+
+    def makeKernel(self, requester):
+        if not self.kernel:
+            path = os.path.join(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))), 'kernels')
+            file, filename, smt = imp.find_module('null', [path])
+            kernelModule = imp.load_module('null', file, filename, smt)
+            self.kernel = kernelModule.MiningKernel(requester)
+        return self.kernel
+
+    def makeQueue(self, requester):
+        if not self.queue:
+            self.queue = CountingWorkQueue(requester, self)
+        return self.queue
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-t', '--time', dest='time', type='float', default=10,
+        help='how many seconds to run for')
+    parser.add_option('-c', '--cores', dest='cores', type='int', default=1,
+        help='how many simulated cores the null kernel runs')
+    parser.add_option('-s', '--size', dest='size', type='int',
+        default=0x100000, help='how many nonces the kernel requests at a time')
+    parser.add_option('-r', '--rate', dest='rate', type='float', default=0.0,
+        help='the rate to simulate per core in Mhash/sec, 0 for unlimited')
+    parser.add_option('--shares', dest='shares', type='float', default=1.0,
+        help='how many shares the kernel finds per 2^32 nonces')
+    parser.add_option('--zerobits', dest='zerobits', type='int', default=8,
+        help='how many zero bits the target requires at the end of a hash')
+    settings, args = parser.parse_args()
+
+    options = BenchmarkOptions(settings)
+    miner = Miner()
+
+    # The reactor should wake up every TICK; any later than that is time it
+    # spent busy with something else.
+    TICK = 0.01
+    reactorLatency = Samples()
+    last = [None]
+    def tick():
+        now = time()
+        if last[0] is not None:
+            reactorLatency.add(max(0, now - last[0] - TICK))
+        last[0] = now
+    ticker = task.LoopingCall(tick)
+
+    def finish(startedAt):
+        elapsed = time() - startedAt
+        ticker.stop()
+        queue = miner.queue
+        connection = miner.connection
+        nonces = sum(core.nonces for core in miner.cores)
+
+        print 'Ran for %.1f seconds with %d core(s), %d nonces per range' % (
+            elapsed, settings.cores, settings.size)
+        if settings.rate:
+            print 'Requested: %.1f ranges/sec' % (
+                settings.cores * settings.rate * 1000000 / settings.size)
+        print 'Ranges:          %.1f ranges/sec (%.1f Mhash/sec)' % (
+            queue.ranges / elapsed, nonces / elapsed / 1000000)
+        print 'Work units:      %d' % connection.units
+        print 'Shares:          %d' % connection.accepted
+        print 'Reactor latency: %s' % reactorLatency.summary()
+        print 'Share path:      %s' % connection.sharePath.summary()
+        reactor.stop()
+
+    miner.start(options)
+    ticker.start(TICK)
+    reactor.callLater(settings.time, finish, time())
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Replays traffic captured with phoenix.py --capture into a Miner, so that
+changes to the queueing and staleness logic can be measured against real
+traffic, offline. The captured work is fed through the real RPCClient and
+MMPClient parsing code, at the captured pace or faster, and results are
+accepted straight away.
+
+    python benchmarks/replay.py [-x SPEED] [-k KERNEL] CAPTURE [KERNEL OPTIONS]
+
+By default the null kernel is used; its RATE should match the rate of the
+miner the capture was taken from (times SPEED).
+"""
+
+import os
+import imp
+import sys
+import urlparse
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet import reactor, defer
+
+from minerutil.Capture import readCapture
+from minerutil.RPCProtocol import RPCClient
+from minerutil.MMPProtocol import MMPClient
+from pipeline import BenchmarkOptions, QuietLogger
+from scenario import MeasuringMiner
+
+class ReplayTransport(object):
+    """Takes the place of a connection's transport, discarding whatever is
+    written to it.
+    """
+
+    connected = True
+
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+    def loseConnection(self):
+        pass
+
+class ReplayMixin(object):
+    """Makes a client take results without sending them anywhere, and keeps
+    count of them.
+    """
+
+    def setupReplay(self):
+        self.units = 0
+        self.submitted = 0
+        self.stale = 0
+        self.prevHash = None
+
+    def workReplayed(self, data):
+        self.units += 1
+        self.prevHash = data[4:36]
+
+    def sendResult(self, result):
+        self.submitted += 1
+        if result[4:36] != self.prevHash:
+            self.stale += 1
+        return defer.succeed(True)
+
+    def requestWork(self):
+        pass
+
+class ReplayRPCClient(ReplayMixin, RPCClient):
+    """An RPCClient that never talks to a server."""
+
+    def __init__(self, handler, url):
+        RPCClient.__init__(self, handler, url)
+        self.setupReplay()
+
+    def connect(self):
+        pass
+
+    def useAskrate(self, variable):
+        # The capture already has every getwork that was asked for.
+        pass
+
+    def handleHeaders(self, headers):
+        # Long polls are replayed from the capture like everything else, so
+        # only the block number is of interest.
+        try:
+            block = int(headers['x-blocknum'])
+        except (KeyError, ValueError):
+            return
+        if self.block != block:
+            self.block = block
+            self.runCallback('block', block)
+
+    def replay(self, kind, args):
+        if kind == 'work':
+            work, headers, pushed = args
+            self.handleWork(work, headers, pushed)
+            if work is not None:
+                self.workReplayed(work['data'].decode('hex'))
+            if not pushed:
+                self.handleHeaders(headers)
+        elif kind == 'failure':
+            self._failure()
+
+class ReplayMMPClient(ReplayMixin, MMPClient):
+    """An MMPClient that never talks to a server."""
+
+    def __init__(self, handler):
+        MMPClient.__init__(self, handler, None, None, 'replay', 'replay')
+        self.setupReplay()
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        self._deactivateCallbacks()
+
+    def replay(self, kind, args):
+        if kind == 'connect':
+            protocol = self.buildProtocol(None)
+            protocol.makeConnection(ReplayTransport())
+        elif kind == 'disconnect':
+            if self.connection is not None:
+                self.connection.connectionLost(None)
+        elif kind == 'recv' and self.connection is not None:
+            line, = args
+            if line.startswith('WORK '):
+                self.workReplayed(line.split(' ')[1].decode('hex'))
+            self.connection.lineReceived(line)
+
+class ReplayOptions(BenchmarkOptions):
+    """Runs a kernel against a replayed capture."""
+
+    def __init__(self, settings, kernelOptions):
+        self.settings = settings
+        self.logger = QuietLogger()
+        self.kernel = None
+        self.queue = None
+        self.url2 = None
+        self.kernelOptions = kernelOptions
+        self.clients = {}
+
+    def makeConnection(self, requester, backup=False):
+        # The replay switches between these as the capture did.
+        rpc = ReplayRPCClient(requester,
+            urlparse.urlparse('http://replay:x@replay/'))
+        self.clients = {'rpc': rpc, 'mmp': ReplayMMPClient(requester)}
+        return Switchboard(self.clients)
+
+    def makeKernel(self, requester):
+        if not self.kernel:
+            path = os.path.join(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))), 'kernels')
+            module = self.settings.kernel
+            file, filename, smt = imp.find_module(module, [path])
+            kernelModule = imp.load_module(module, file, filename, smt)
+            self.kernel = kernelModule.MiningKernel(requester)
+        return self.kernel
+
+class Switchboard(object):
+    """Stands in for the Miner's connection, passing calls on to whichever
+    replayed client is current.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.current = clients['rpc']
+
+    def switch(self, name):
+        self.current = self.clients[name]
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+def main():
+    parser = OptionParser(
+        usage='%prog [options] CAPTURE [kernel params]')
+    parser.add_option('-x', '--speed', dest='speed', type='float',
+        default=1.0, help='how many times faster than real time to replay, '
+        'or 0 for as fast as possible')
+    parser.add_option('-k', '--kernel', dest='kernel', default='null',
+        help='the name of the kernel to use')
+    settings, args = parser.parse_args()
+    if not args:
+        parser.print_usage()
+        return
+
+    kernelOptions = {}
+    for arg in args[1:]:
+        pair = arg.split('=', 1)
+        if len(pair) < 2:
+            pair.append(None)
+        kernelOptions[pair[0].upper()] = pair[1]
+
+    options = ReplayOptions(settings, kernelOptions)
+    miner = MeasuringMiner()
+    miner.start(options)
+    switchboard = miner.connection
+
+    events = readCapture(args[0])
+    startedAt = time()
+    stats = {'events': 0}
+
+    def finish():
+        elapsed = time() - startedAt
+        clients = options.clients.values()
+        submitted = sum(client.submitted for client in clients)
+        stale = sum(client.stale for client in clients)
+        print 'Replayed %d events in %.1f seconds' % (stats['events'], elapsed)
+        print 'Work units:  %d' % sum(client.units for client in clients)
+        print 'Submitted:   %d' % submitted
+        print 'Stale:       %d (%.2f%%)' % (stale,
+            100.0 * stale / submitted if submitted else 0)
+        print 'Idle time:   %.2fs' % miner.getIdleTime()
+        reactor.stop()
+
+    def replayNext():
+        try:
+            t, kind, args = events.next()
+        except StopIteration:
+            finish()
+            return
+
+        # Wait until the event is due.
+        delay = 0
+        if settings.speed:
+            delay = max(0, startedAt + t / settings.speed - time())
+        reactor.callLater(delay, replayEvent, kind, args)
+
+    def replayEvent(kind, args):
+        stats['events'] += 1
+        if kind == 'client':
+            switchboard.switch(args[0])
+        else:
+            switchboard.replay(kind, args)
+        replayNext()
+
+    reactor.callLater(0, replayNext)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
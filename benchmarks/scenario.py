@@ -0,0 +1,226 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Runs Phoenix against the PoolSimulator through scripted scenarios, and
+measures how its networking holds up: the round trip time for getwork, the
+stale rate, how long the miner sat idle and how long results took to be
+acknowledged. Both RPCClient and MMPClient are covered.
+
+A scenario file is a JSON list of scenarios, such as:
+
+    [{"name": "rpc-lossy", "protocol": "rpc", "duration": 30,
+      "latency": 0.1, "jitter": 0.05, "errors": 0.05, "block": 10,
+      "steps": [{"at": 15, "disconnect": true},
+                {"at": 20, "set": {"latency": 0.5}}]}]
+
+Every key but "name" and "protocol" is optional. "block" and "disconnect"
+give intervals; steps run once, at the given second. Without a file, a default
+set of scenarios is run. Each scenario runs in a process of its own.
+"""
+
+import os
+import sys
+import json
+import subprocess
+from time import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet import reactor
+
+import minerutil
+import PoolSimulator
+from pipeline import BenchmarkOptions, Samples
+from Miner import Miner
+
+DEFAULT_SCENARIOS = [
+    {'name': 'rpc-baseline', 'protocol': 'rpc', 'duration': 20},
+    {'name': 'rpc-faults', 'protocol': 'rpc', 'duration': 30,
+     'latency': 0.1, 'jitter': 0.1, 'errors': 0.05, 'block': 10,
+     'steps': [{'at': 15, 'disconnect': True}]},
+    {'name': 'mmp-baseline', 'protocol': 'mmp', 'duration': 20},
+    {'name': 'mmp-faults', 'protocol': 'mmp', 'duration': 30,
+     'latency': 0.1, 'jitter': 0.1, 'errors': 0.05, 'block': 10,
+     'steps': [{'at': 15, 'disconnect': True}]},
+]
+
+class MeasuringMiner(Miner):
+    """A Miner that keeps track of the time it spends waiting for work and
+    for its results to be answered.
+    """
+
+    def __init__(self):
+        Miner.__init__(self)
+        self.askedAt = None
+        self.roundTrips = Samples()
+        self.submits = Samples()
+
+    def onWork(self, work):
+        if self.askedAt is not None:
+            self.roundTrips.add(time() - self.askedAt)
+            self.askedAt = None
+        Miner.onWork(self, work)
+
+    def measureConnection(self, connection):
+        """Wrap the connection's requests so they are timed."""
+        requestWork = connection.requestWork
+        sendResult = connection.sendResult
+
+        def timedRequestWork():
+            if self.askedAt is None:
+                self.askedAt = time()
+            requestWork()
+
+        def timedSendResult(result):
+            sentAt = time()
+            d = sendResult(result)
+            def callback(accepted):
+                self.submits.add(time() - sentAt)
+                return accepted
+            d.addCallback(callback)
+            return d
+
+        connection.requestWork = timedRequestWork
+        connection.sendResult = timedSendResult
+
+class ScenarioOptions(BenchmarkOptions):
+    """Runs the null kernel against the simulated pool."""
+
+    def __init__(self, settings, url):
+        BenchmarkOptions.__init__(self, settings)
+        self.url = url
+
+    def getQueueSize(self):
+        return self.settings.queuesize
+
+    def makeConnection(self, requester, backup=False):
+        connection = minerutil.openURL(self.url, requester)
+        requester.measureConnection(connection)
+        return connection
+
+def runScenario(scenario, settings):
+    """Run one scenario in this process, returning its results."""
+    pool = PoolSimulator.SimulatedPool(scenario.get('zerobits', 8),
+        scenario.get('rollntime', 0), scenario.get('latency', 0.0),
+        scenario.get('jitter', 0.0), scenario.get('errors', 0.0))
+
+    protocol = scenario['protocol']
+    if protocol == 'rpc':
+        port, = PoolSimulator.listen(pool, httpPort=0)
+        url = 'http://phoenix:x@127.0.0.1:%d/' % port.getHost().port
+    elif protocol == 'mmp':
+        port, = PoolSimulator.listen(pool, mmpPort=0)
+        url = 'mmp://phoenix:x@127.0.0.1:%d/' % port.getHost().port
+    else:
+        raise ValueError('Unknown protocol: ' + protocol)
+
+    miner = MeasuringMiner()
+    miner.start(ScenarioOptions(settings, url))
+
+    pool.setBlockInterval(scenario.get('block'))
+    pool.setDisconnectInterval(scenario.get('disconnect'))
+
+    def runStep(step):
+        if step.get('block'):
+            pool.newBlock()
+        if step.get('disconnect'):
+            pool.disconnect()
+        for var, value in step.get('set', {}).items():
+            setattr(pool, var, value)
+    for step in scenario.get('steps', []):
+        reactor.callLater(step['at'], runStep, step)
+
+    results = {}
+    def finish():
+        stats = pool.stats
+        submitted = stats['accepted'] + stats['rejected']
+        results.update({
+            'name': scenario['name'],
+            'protocol': protocol,
+            'duration': scenario.get('duration', 20),
+            'getworkRTT': miner.roundTrips.summary(),
+            'submitLatency': miner.submits.summary(),
+            'staleRate': float(stats['stale']) / submitted if submitted else 0,
+            'idleTime': miner.getIdleTime(),
+            'pool': stats,
+        })
+        reactor.stop()
+    reactor.callLater(scenario.get('duration', 20), finish)
+    reactor.run()
+    return results
+
+def main():
+    parser = OptionParser(usage='%prog [options] [SCENARIOS.json]')
+    parser.add_option('-c', '--cores', dest='cores', type='int', default=2,
+        help='how many simulated cores the null kernel runs')
+    parser.add_option('-s', '--size', dest='size', type='int',
+        default=0x400000, help='how many nonces the kernel requests at a time')
+    parser.add_option('-r', '--rate', dest='rate', type='float',
+        default=1000.0, help='the rate to simulate per core in Mhash/sec')
+    parser.add_option('--shares', dest='shares', type='float', default=64.0,
+        help='how many shares the kernel finds per 2^32 nonces')
+    parser.add_option('-q', '--queuesize', dest='queuesize', type='int',
+        default=1, help='how many work units to keep queued')
+    parser.add_option('--run', dest='run', type='int', default=None,
+        help='run only the scenario with this index, printing JSON')
+    parser.add_option('--json', dest='json', action='store_true',
+        default=False, help='print all the results as JSON')
+    settings, args = parser.parse_args()
+
+    if args:
+        scenarios = json.load(open(args[0]))
+    else:
+        scenarios = DEFAULT_SCENARIOS
+
+    if settings.run is not None:
+        print json.dumps(runScenario(scenarios[settings.run], settings))
+        return
+
+    # Each scenario gets its own process, and so its own reactor.
+    allResults = []
+    for i, scenario in enumerate(scenarios):
+        command = [sys.executable, os.path.abspath(__file__),
+            '--run', str(i), '-c', str(settings.cores),
+            '-s', str(settings.size), '-r', str(settings.rate),
+            '--shares', str(settings.shares), '-q', str(settings.queuesize)]
+        command += args
+        output = subprocess.check_output(command)
+        results = json.loads(output.strip().splitlines()[-1])
+        allResults.append(results)
+
+        if not settings.json:
+            print '%s (%s, %ds):' % (results['name'], results['protocol'],
+                results['duration'])
+            print '  getwork RTT:    %s' % results['getworkRTT']
+            print '  submit latency: %s' % results['submitLatency']
+            print '  stale rate:     %.2f%%' % (100*results['staleRate'])
+            print '  idle time:      %.2fs' % results['idleTime']
+            print '  pool:           %s' % ' '.join('%s=%d' % item
+                for item in sorted(results['pool'].items()))
+
+    if settings.json:
+        print json.dumps(allResults, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import platform
+import signal
+import numpy as np
+import multiprocessing
+from time import time
+from struct import unpack
+from twisted.internet import reactor
+
+from minerutil.Midstate import calculateMidstate, K
+from QueueReader import QueueReader
+from KernelInterface import *
+
+MASK = 0xFFFFFFFF
+
+# The SHA-256 initial state, for the second hash.
+IV = (0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+      0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19)
+
+# The hashing below works on a mix of plain ints, for the values that are the
+# same for every nonce, and uint32 arrays holding one value per nonce. Mixing
+# the two keeps the arrays uint32 as long as the ints are kept within 32 bits,
+# which these helpers take care of.
+
+def add(*values):
+    constant = 0
+    array = None
+    for value in values:
+        if isinstance(value, (int, long)):
+            constant += value
+        elif array is None:
+            array = value
+        else:
+            array = array + value
+    constant &= MASK
+    if array is None:
+        return constant
+    return array + np.uint32(constant)
+
+def rotr(x, n):
+    if isinstance(x, (int, long)):
+        return (x >> n | x << (32-n)) & MASK
+    return x >> n | x << (32-n)
+
+def sigma0(x):
+    return rotr(x, 7) ^ rotr(x, 18) ^ (x >> 3)
+
+def sigma1(x):
+    return rotr(x, 17) ^ rotr(x, 19) ^ (x >> 10)
+
+def compress(state, W, first, last):
+    """Run SHA-256 rounds first..last-1 over the state, expanding the message
+    schedule W in place as it goes.
+    """
+    a,b,c,d,e,f,g,h = state
+    for i in xrange(first, last):
+        if i >= len(W):
+            W.append(add(sigma1(W[i-2]), W[i-7], sigma0(W[i-15]), W[i-16]))
+        s0 = rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)
+        s1 = rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)
+        ma = (a & b) | (c & (a | b))
+        ch = g ^ (e & (f ^ g))
+        t1 = add(h, s1, ch, K[i], W[i])
+        a,b,c,d,e,f,g,h = add(t1, s0, ma), a, b, c, add(d, t1), e, f, g
+    return [a,b,c,d,e,f,g,h]
+
+def search(state, state2, data, f, base, size):
+    """Check size nonces starting at base, and return those whose hash ends in
+    32 zero bits. This runs in the worker processes.
+    """
+
+    nonces = base + np.arange(size, dtype=np.uint32)
+
+    # The first three rounds don't depend on the nonce, so the second block
+    # starts from state2. W16 and W17 don't either.
+    W = list(data) + [nonces, 0x80000000] + [0]*10 + [0x280] + list(f)
+    first = compress(state2, W, 3, 64)
+    digest = [add(x, y) for x,y in zip(first, state)]
+
+    # Only the last word of the second hash needs to be checked, and that is
+    # already known after 61 rounds.
+    W = digest + [0x80000000] + [0]*6 + [0x100]
+    second = compress(IV, W, 0, 61)
+    found = add(second[4], IV[7]) == 0
+
+    return [int(nonce) for nonce in nonces[found]]
+
+def ignoreInterrupts():
+    # Ctrl+C is handled by the miner, which stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class KernelData(object):
+    """This class is a container for all the data required for a single
+    execution.
+    """
+
+    def __init__(self, nonceRange):
+        data = unpack('<III', nonceRange.unit.data[64:76])
+
+        self.nr = nonceRange
+        self.base = nonceRange.base
+        self.size = nonceRange.size
+
+        # Set up the state and the precalculated static data, as the OpenCL
+        # kernels do.
+        self.state = unpack('<IIIIIIII', nonceRange.unit.midstate)
+        self.state2 = unpack('<IIIIIIII',
+            calculateMidstate(nonceRange.unit.data[64:80] +
+                '\x00\x00\x00\x80' + '\x00'*40 + '\x80\x02\x00\x00',
+                nonceRange.unit.midstate, 3))
+        self.data = data
+        self.calculateF(data)
+
+    def calculateF(self, data):
+        # W16
+        W16 = add(data[0], sigma0(data[1]))
+        # W17
+        W17 = add(data[1], sigma0(data[2]), 0x01100000)
+        self.f = (W16, W17)
+
+    def getArguments(self):
+        return (self.state, self.state2, self.data, self.f, self.base,
+            self.size)
+
+class CPUCore(object):
+    """One worker process, and the core and QueueReader that feed it."""
+
+    def __init__(self, kernel):
+        self.core = kernel.interface.addCore()
+        self.qr = QueueReader(self.core, KernelData,
+            lambda t, size: kernel.getWorkSize(t, size))
+
+class MiningKernel(object):
+    """A Phoenix Miner-compatible kernel that hashes on the CPU, with NumPy."""
+
+    PROCESSES = KernelOption(
+        'PROCESSES', int, default=None,
+        help='How many worker processes to run, by default one per CPU core')
+    EXECUTION_TIME = KernelOption(
+        'EXECUTION_TIME', float, default=1.0, advanced=True,
+        help='How long each worker should spend on a range, in seconds')
+
+    # The first ranges are this big, until the rate is known.
+    INITIAL_SIZE = 0x10000
+
+    # The worker processes check a range in chunks of this many nonces, to
+    # keep their memory use down.
+    CHUNK_SIZE = 0x10000
+
+    # This must be manually set for Git
+    REVISION = 1
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.stopped = False
+
+        if self.PROCESSES is None:
+            self.PROCESSES = multiprocessing.cpu_count()
+        self.PROCESSES = max(1, self.PROCESSES)
+
+        # The pool is started now, before the reactor (and its threads) are.
+        self.pool = multiprocessing.Pool(self.PROCESSES, ignoreInterrupts)
+        self.cores = [CPUCore(self) for i in range(self.PROCESSES)]
+
+        # Each worker is waited on by a thread of its own.
+        reactor.suggestThreadPoolSize(max(10, self.PROCESSES + 5))
+
+        self.applyMeta()
+
+    def applyMeta(self):
+        """Apply any kernel-specific metadata."""
+        self.interface.setMeta('kernel', 'cpu r%s' % self.REVISION)
+        self.interface.setMeta('device',
+            platform.processor() or platform.machine())
+        self.interface.setMeta('cores', self.PROCESSES)
+
+    def getWorkSize(self, t, size):
+        """Size the ranges so that each takes about EXECUTION_TIME."""
+        if t is None or t <= 0:
+            return self.INITIAL_SIZE
+        return max(self.CHUNK_SIZE, int(size * self.EXECUTION_TIME / t))
+
+    def start(self):
+        """Phoenix wants the kernel to start."""
+        for core in self.cores:
+            core.qr.start()
+            reactor.callInThread(self.mineThread, core)
+
+    def stop(self):
+        """Phoenix wants this kernel to stop. The kernel is not necessarily
+        reusable, so it's safe to clean up as well.
+        """
+        self.stopped = True
+        for core in self.cores:
+            core.qr.stop()
+        self.pool.terminate()
+
+    def postprocess(self, nonces, nr):
+        for nonce in nonces:
+            self.interface.foundNonce(nr, nonce)
+
+    def mineThread(self, core):
+        timer = executionTime.labels('cpu')
+        for data in core.qr:
+            state, state2, words, f, base, size = data.getArguments()
+            for offset in xrange(0, size, self.CHUNK_SIZE):
+                chunk = min(self.CHUNK_SIZE, size - offset)
+                startedAt = time()
+                result = self.pool.apply_async(search,
+                    (state, state2, words, f, base + offset, chunk))
+
+                # Waiting with a timeout keeps this thread responsive to
+                # stop(), after which the pool never answers.
+                while not result.ready():
+                    if self.stopped:
+                        return
+                    result.wait(0.5)
+                nonces = result.get()
+                timer.since(startedAt)
+
+                if nonces:
+                    reactor.callFromThread(self.postprocess, nonces, data.nr)
@@ -0,0 +1,144 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import random
+from time import time, sleep
+from twisted.internet import reactor
+
+from QueueReader import QueueReader
+from KernelInterface import *
+
+class MiningKernel(object):
+    """A Phoenix Miner-compatible kernel that doesn't hash at all. It works
+    through NonceRanges at a simulated rate and finds shares at a set
+    probability, so that the rest of Phoenix can be measured on its own.
+
+    Shares are found by trying nonces in the range with calculateHash until one
+    meets the work's target, so they are only valid if that target is easy
+    enough.
+    """
+
+    RATE = KernelOption(
+        'RATE', float, default=0.0,
+        help='The rate to simulate per core, in Mhash/sec, or 0 to go as fast '
+        'as possible')
+    SHARES = KernelOption(
+        'SHARES', float, default=1.0,
+        help='How many shares to find per 2^32 nonces; 1 is what a real '
+        'miner finds at difficulty 1')
+    CORES = KernelOption(
+        'CORES', int, default=1,
+        help='How many simulated cores to run')
+    SIZE = KernelOption(
+        'SIZE', int, default=0x100000, advanced=True,
+        help='How many nonces to request per execution')
+
+    # How many nonces to try when looking for a share, before giving up.
+    MAX_TRIES = 0x10000
+
+    # This must be manually set for Git
+    REVISION = 1
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.warned = False
+
+        # The time the share being submitted was found. The share path runs
+        # synchronously from postprocess, so whatever it ends up calling can
+        # read this to measure the latency.
+        self.foundAt = None
+
+        self.cores = []
+        for i in range(max(1, self.CORES)):
+            core = self.interface.addCore()
+            qr = QueueReader(core, None, lambda x,y: self.SIZE)
+            self.cores.append(qr)
+
+        reactor.suggestThreadPoolSize(max(10, len(self.cores) + 5))
+
+        self.applyMeta()
+
+    def applyMeta(self):
+        """Apply any kernel-specific metadata."""
+        self.interface.setMeta('kernel', 'null r%s' % self.REVISION)
+        self.interface.setMeta('device', 'null')
+        self.interface.setMeta('cores', len(self.cores))
+
+    def start(self):
+        """Phoenix wants the kernel to start."""
+        for qr in self.cores:
+            qr.start()
+            reactor.callInThread(self.mineThread, qr)
+
+    def stop(self):
+        """Phoenix wants this kernel to stop. The kernel is not necessarily
+        reusable, so it's safe to clean up as well.
+        """
+        for qr in self.cores:
+            qr.stop()
+
+    def findShare(self, nr):
+        """Try nonces from a random place in the range until one meets the
+        target, returning None if that doesn't happen soon enough.
+        """
+        start = random.randrange(nr.size)
+        for i in xrange(min(nr.size, self.MAX_TRIES)):
+            nonce = nr.base + (start + i) % nr.size
+            hash = self.interface.calculateHash(nr, nonce)
+            if self.interface.checkTarget(hash, nr.unit.target):
+                return nonce
+        return None
+
+    def postprocess(self, nonces, nr, foundAt):
+        self.foundAt = foundAt
+        for nonce in nonces:
+            if nonce is not None:
+                self.interface.foundNonce(nr, nonce)
+        self.foundAt = None
+
+        if None in nonces and not self.warned:
+            self.warned = True
+            self.interface.error('Could not find a share, the target is '
+                'too hard for the null kernel.')
+
+    def mineThread(self, qr):
+        rate = self.RATE * 1000000
+        timer = executionTime.labels('null')
+        for nr in qr:
+            startedAt = time()
+
+            # The number of shares in the range, on average SHARES per 2^32.
+            expected = self.SHARES * nr.size / 0x100000000
+            count = int(expected)
+            if random.random() < expected - count:
+                count += 1
+
+            nonces = [self.findShare(nr) for i in xrange(count)]
+            if nonces:
+                reactor.callFromThread(self.postprocess, nonces, nr, time())
+
+            # Take as long as the simulated device would have.
+            if rate:
+                remaining = nr.size / rate - (time() - startedAt)
+                if remaining > 0:
+                    sleep(remaining)
+            timer.since(startedAt)
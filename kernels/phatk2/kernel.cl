@@ -142,7 +142,7 @@ void search(	const uint state0, const uint state1, const uint state2, const uint
 						const uint state4, const uint state5, const uint state6, const uint state7,
 						const uint B1, const uint C1, const uint D1,
 						const uint F1, const uint G1, const uint H1,
-						const u base,
+						const uint base,
 						const uint W16, const uint W17,
 						const uint PreVal4, const uint PreVal0,
 						const uint PreW31, const uint PreW32,
@@ -169,18 +169,18 @@ void search(	const uint state0, const uint state1, const uint state2, const uint
 	W[17] = W17;
 
 #ifdef VECTORS4
-	//Less dependencies to get both the local id and group id and then add them
-	W[3] = base + (uint)(get_local_id(0)) * 4u + (uint)(get_group_id(0)) * (WORKSIZE * 4u);
+	//The base and the global id (which includes the global offset the host moves along for each execution of a range) count vectors
+	W[3] = ((base + (uint)(get_global_id(0))) << 2) + (u){0u, 1u, 2u, 3u};
 	uint r = rot(W[3].x,25u)^rot(W[3].x,14u)^((W[3].x)>>3U);
 	//Since only the 2 LSB is opposite between the nonces, we can save an instruction by flipping the 4 bits in W18 rather than the 1 bit in W3
 	W[18] = PreW20 + (u){r, r ^ 0x2004000U, r ^ 0x4008000U, r ^ 0x600C000U};
 #else
 	#ifdef VECTORS
-		W[3] = base + (uint)(get_local_id(0)) * 2u + (uint)(get_group_id(0)) * (WORKSIZE * 2u);
+		W[3] = ((base + (uint)(get_global_id(0))) << 1) + (u){0u, 1u};
 		uint r = rot(W[3].x,25u)^rot(W[3].x,14u)^((W[3].x)>>3U);
 		W[18] = PreW20 + (u){r, r ^ 0x2004000U};
 	#else
-		W[3] = base + get_local_id(0) + get_group_id(0) * (WORKSIZE);
+		W[3] = base + get_global_id(0);
 		u r = rot(W[3],25u)^rot(W[3],14u)^((W[3])>>3U);
 		W[18] = PreW20 + r;
 	#endif
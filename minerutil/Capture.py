@@ -0,0 +1,70 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import gzip
+import json
+from time import time
+
+class CaptureFile(object):
+    """Records a client's traffic with the server, so that it can be replayed
+    later. Every event is written as a JSON list of the seconds since the
+    capture began, the kind of event, and its arguments, one per line, and the
+    whole file is gzipped.
+    """
+
+    def __init__(self, fileName):
+        self.file = gzip.open(fileName, 'wb')
+        self.startedAt = time()
+
+    def record(self, kind, *args):
+        if self.file is None:
+            return
+        event = [round(time() - self.startedAt, 4), kind] + list(args)
+        self.file.write(json.dumps(event, separators=(',',':')) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def readCapture(fileName):
+    """Iterate over the events in a capture, as (time, kind, args) tuples.
+
+    A capture that wasn't closed properly (e.g. because Phoenix was killed)
+    is read up to where it ends.
+    """
+    f = gzip.open(fileName, 'rb')
+    try:
+        while True:
+            try:
+                line = f.readline()
+            except (IOError, EOFError):
+                break
+            if not line:
+                break
+            try:
+                event = json.loads(line)
+            except ValueError:
+                break
+            yield event[0], event[1], event[2:]
+    finally:
+        f.close()
@@ -34,6 +34,20 @@ class AssignedWork(object):
 
 class ClientBase(object):
     callbacksActive = True
+    capture = None
+
+    # The name the client goes by in captures.
+    captureName = None
+
+    def setCapture(self, capture):
+        """Record the traffic with the server to a CaptureFile."""
+        self.capture = capture
+        self.record('client', self.captureName)
+
+    def record(self, kind, *args):
+        """Record an event to the capture, if there is one."""
+        if self.capture is not None:
+            self.capture.record(kind, *args)
 
     def _deactivateCallbacks(self):
         """Shut down the runCallback function. Typically used post-disconnect.
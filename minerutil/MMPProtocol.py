@@ -19,59 +19,149 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import math
+from time import time
+from collections import OrderedDict
 from twisted.internet import reactor, defer
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.protocols.basic import LineReceiver
 
 from ClientBase import *
+from Metrics import registry
+
+getworkTime = registry.timer('phoenix_getwork_seconds',
+    'Time from asking the server for work to receiving it.')
+mmpLines = registry.counter('phoenix_mmp_lines_total',
+    'Lines exchanged with the MMP server.', ('direction',))
+receivedLines = mmpLines.labels('received')
+sentLines = mmpLines.labels('sent')
+resultTime = registry.timer('phoenix_mmp_result_seconds',
+    'Time from sending a RESULT to the MMP server answering it.')
+results = registry.counter('phoenix_mmp_results_total',
+    'RESULTs sent to the MMP server, by what became of them.', ('outcome',))
 
 class MMPProtocolBase(LineReceiver):
     delimiter = '\r\n'
     commands = {} # To be overridden by superclasses...
 
+    # Lines waiting to be written at the end of this reactor iteration.
+    outgoing = None
+
+    def sendLine(self, line):
+        """Queue a line to be sent. All the lines sent during one iteration of
+        the reactor go out in a single write.
+        """
+        self.scheduleFlush()
+        self.outgoing.append(line)
+
+    def scheduleFlush(self):
+        if self.outgoing is None:
+            self.outgoing = []
+            reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """Write the queued lines now."""
+        lines = self.outgoing
+        self.outgoing = None
+        if lines and self.transport is not None:
+            self.transport.write(self.delimiter.join(lines) + self.delimiter)
+
+    @classmethod
+    def getDispatch(cls):
+        """Return the dispatch table for this class, building it the first
+        time. It maps each command to its handler (as an unbound method) and
+        the conversions for its arguments, where None means the argument is
+        left as a string.
+        """
+        dispatch = cls.__dict__.get('_dispatch')
+        if dispatch is None:
+            dispatch = {}
+            for cmd, types in cls.commands.items():
+                function = getattr(cls, 'cmd_' + cmd, None)
+                if function is not None:
+                    dispatch[cmd] = (function,
+                        tuple(None if t is str else t for t in types))
+            cls._dispatch = dispatch
+        return dispatch
+
     def lineReceived(self, line):
         # The protocol uses IRC-style argument passing. i.e. space-separated
         # arguments, with the final one optionally beginning with ':' (in which
         # case, the final argument is the only one that may contain spaces).
+
+        # Nearly all lines have one or two arguments, so those are picked
+        # apart without building any lists.
+        cmd, space, rest = line.partition(' ')
+        entry = self.getDispatch().get(cmd)
+        if entry is None:
+            return
+        function, types = entry
+        count = len(types)
+        if space and count == 1:
+            if rest[:1] == ':':
+                rest = rest[1:]
+            elif ' ' in rest:
+                count = None
+            if count is not None:
+                t = types[0]
+                try:
+                    if t is not None:
+                        rest = t(rest)
+                except (ValueError, TypeError):
+                    self.illegalCommand(cmd)
+                    return
+                function(self, rest)
+                return
+        elif space and count == 2 and rest[:1] != ':':
+            first, space, second = rest.partition(' ')
+            if space and second[:1] == ':':
+                second = second[1:]
+            elif ' ' in second:
+                space = None
+            if space:
+                t1, t2 = types
+                try:
+                    if t1 is not None:
+                        first = t1(first)
+                    if t2 is not None:
+                        second = t2(second)
+                except (ValueError, TypeError):
+                    self.illegalCommand(cmd)
+                    return
+                function(self, first, second)
+                return
+
         halves = line.split(' :', 1)
         args = halves[0].split(' ') # The space-separated part.
         if len(halves) == 2:
             args.append(halves[1]) # The final argument; could contain spaces.
 
-        cmd = args[0]
-        args = args[1:]
-
-        self.handleCommand(cmd, args)
+        self.handleCommand(args[0], args[1:])
 
     def handleCommand(self, cmd, args):
         """Handle a parsed command.
 
         This function takes care of converting arguments to their appropriate
-        types and then calls the function handler. If a command is unknown,
-        it is dispatched to illegalCommand.
+        types and then calls the function handler. If the arguments don't
+        fit the command, it is dispatched to illegalCommand.
         """
-        function = getattr(self, 'cmd_' + cmd, None)
-
-        if function is None or cmd not in self.commands:
+        entry = self.getDispatch().get(cmd)
+        if entry is None:
             return
 
-        types = self.commands[cmd]
+        function, types = entry
 
         if len(types) != len(args):
-            converted = False
-        else:
-            converted = True # Unless the below loop has a conversion problem.
-            for i,t in enumerate(types):
-                try:
-                    args[i] = t(args[i])
-                except (ValueError, TypeError):
-                    converted = False
-                    break
+            self.illegalCommand(cmd)
+            return
 
-        if converted:
-            function(*args)
-        else:
+        try:
+            args = [a if t is None else t(a) for t, a in zip(types, args)]
+        except (ValueError, TypeError):
             self.illegalCommand(cmd)
+            return
+
+        function(self, *args)
 
     def illegalCommand(self, cmd):
         pass # To be overridden by superclasses...
@@ -98,7 +188,11 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
     }
 
     def connectionMade(self):
+        self.pendingMeta = OrderedDict()
         self.factory.connection = self
+        self.factory.record('connect')
+        # The server gives work as soon as it accepts the login.
+        self.factory.requestedAt = time()
         self.runCallback('connect')
         self.sendLine('LOGIN %s :%s' % (self.factory.username,
                                         self.factory.password))
@@ -108,14 +202,37 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
         self.metaSent = True
 
     def connectionLost(self, reason):
+        self.factory.record('disconnect')
         self.runCallback('disconnect')
         self.factory.connection = None
         self.factory._purgeDeferreds()
 
+    def lineReceived(self, line):
+        self.factory.record('recv', line)
+        receivedLines.inc()
+        MMPProtocolBase.lineReceived(self, line)
+
+    def sendLine(self, line):
+        self.factory.record('send', line)
+        sentLines.inc()
+        MMPProtocolBase.sendLine(self, line)
+
     def sendMeta(self, var, value):
-        # Don't include ':' when sending a meta int, as per the protocol spec.
-        colon = '' if isinstance(value, int) else ':'
-        self.sendLine('META %s %s%s' % (var, colon, value))
+        # Metavariables go out with the next flush, so a variable that changes
+        # several times in one iteration is only sent once.
+        self.scheduleFlush()
+        self.pendingMeta[var] = value
+
+    def flush(self):
+        pendingMeta = self.pendingMeta
+        if pendingMeta:
+            self.pendingMeta = OrderedDict()
+            for var, value in pendingMeta.items():
+                # Don't include ':' when sending a meta int, as per the
+                # protocol spec.
+                colon = '' if isinstance(value, int) else ':'
+                self.sendLine('META %s %s%s' % (var, colon, value))
+        MMPProtocolBase.flush(self)
 
     def cmd_MSG(self, message):
         self.runCallback('msg', message)
@@ -144,6 +261,9 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
         wu.target = self.target
         wu.setMaxTimeIncrement(self.time)
         wu.identifier = data[4:36]
+        if self.factory.requestedAt is not None:
+            getworkTime.since(self.factory.requestedAt)
+            self.factory.requestedAt = None
         self.runCallback('work', wu)
         # Since the server is giving work, we know it has accepted our
         # login details, so we can reset the factory's reconnect delay.
@@ -165,6 +285,7 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
     """
 
     protocol = MMPClientProtocol
+    captureName = 'mmp'
     maxDelay = 60
     initialDelay = 0.2
 
@@ -172,8 +293,14 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
     password = None
     meta = {'version': 'MMPClient v1.0 by CFSworks'}
 
-    deferreds = {}
+    # How long to wait for the server to answer a RESULT, in seconds, and how
+    # many RESULTs may be waiting for an answer at once. When there are more,
+    # the oldest is given up on.
+    resultTimeout = 60
+    maxOutstanding = 100
+
     connection = None
+    requestedAt = None
 
     def __init__(self, handler, host, port, username, password):
         self.handler = handler
@@ -181,6 +308,10 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         self.port = port
         self.username = username
         self.password = password
+        self.meta = dict(self.meta)
+        # Results waiting for an answer, oldest first. Each is kept as
+        # [deferreds, time sent, timeout call].
+        self.outstanding = OrderedDict()
 
     def buildProtocol(self, addr):
         p = self.protocol()
@@ -207,6 +338,7 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         self._deactivateCallbacks()
 
         if self.connection is not None:
+            self.connection.flush()
             self.connection.transport.loseConnection()
 
         self.stopTrying()
@@ -217,12 +349,17 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         next login anyway.
         """
         if self.connection is not None:
+            if self.requestedAt is None:
+                self.requestedAt = time()
             self.connection.sendLine('MORE')
 
     def setMeta(self, var, value):
         """Set a metavariable, which gets sent to the server on-connect (or
-        immediately, if already connected.)
+        immediately, if already connected.) Setting a metavariable to the value
+        it already has does nothing.
         """
+        if var in self.meta and self.meta[var] == value:
+            return
         self.meta[var] = value
         if self.connection and self.connection.metaSent:
             self.connection.sendMeta(var, value)
@@ -252,18 +389,31 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
 
         d = defer.Deferred()
 
-        if result in self.deferreds:
-            self.deferreds[result].chainDeferred(d)
+        if result in self.outstanding:
+            self.outstanding[result][0].append(d)
         else:
-            self.deferreds[result] = d
+            while len(self.outstanding) >= self.maxOutstanding:
+                self._resultFinished(next(iter(self.outstanding)), False,
+                    'evicted')
+            timeout = reactor.callLater(self.resultTimeout,
+                self._resultFinished, result, False, 'timeout')
+            self.outstanding[result] = [[d], time(), timeout]
 
         self.connection.sendLine('RESULT ' + result.encode('hex'))
         return d
 
+    def _resultFinished(self, result, accepted, outcome):
+        """Stop waiting for a result, firing its deferreds."""
+        deferreds, sentAt, timeout = self.outstanding.pop(result)
+        if timeout.active():
+            timeout.cancel()
+        results.labels(outcome).inc()
+        for d in deferreds:
+            d.callback(accepted)
+
     def _purgeDeferreds(self):
-        for d in self.deferreds.values():
-            d.callback(False)
-        self.deferreds = {}
+        for result in list(self.outstanding):
+            self._resultFinished(result, False, 'disconnected')
 
     def _resultReturned(self, data, accepted):
         try:
@@ -271,6 +421,113 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         except (TypeError, ValueError):
             return
 
-        if data in self.deferreds:
-            self.deferreds[data].callback(accepted)
-            del self.deferreds[data]
\ No newline at end of file
+        if data in self.outstanding:
+            resultTime.since(self.outstanding[data][1])
+            self._resultFinished(data, accepted,
+                'accepted' if accepted else 'rejected')
+
+class MMPServerProtocol(MMPProtocolBase):
+    """The server side of an MMP connection. Subclasses decide what work to
+    give out and what to do with results by overriding the hooks below, and
+    answer through the send* functions.
+
+    Clients may ask for work sized to their rate by setting the "rate" (in
+    Khash/sec) and "unittime" (in seconds) metavariables; getMask works out
+    the mask for that.
+    """
+
+    loggedIn = False
+
+    # The smallest mask getMask gives, so that fast-changing rates can't make
+    # a client ask for work every few milliseconds.
+    MIN_MASK = 16
+
+    commands = {
+        'LOGIN':    (str, str),
+        'META':     (str, str),
+        'MORE':     (),
+        'RESULT':   (str,),
+    }
+
+    def connectionMade(self):
+        self.meta = {}
+
+    def sendMessage(self, message):
+        self.sendLine('MSG :%s' % message)
+
+    def sendTarget(self, target):
+        self.sendLine('TARGET %s' % target.encode('hex'))
+
+    def sendTime(self, seconds):
+        self.sendLine('TIME %d' % seconds)
+
+    def sendBlock(self, block):
+        self.sendLine('BLOCK %d' % block)
+
+    def sendWork(self, data, mask):
+        self.sendLine('WORK %s %d' % (data.encode('hex'), mask))
+
+    def answerResult(self, result, accepted):
+        """Answer a RESULT, which is given as it was received."""
+        self.sendLine('%s %s' % ('ACCEPTED' if accepted else 'REJECTED',
+            result.encode('hex')))
+
+    def getMask(self, default=32):
+        """Return the mask for work that would take the client about as long
+        as it asked for, or the default if it hasn't said.
+        """
+        try:
+            nonces = float(self.meta['rate']) * 1000 * float(
+                self.meta['unittime'])
+        except (KeyError, ValueError):
+            return default
+        if not nonces > 1:
+            return default
+        mask = int(math.ceil(math.log(nonces, 2)))
+        return max(self.MIN_MASK, min(32, mask))
+
+    def cmd_LOGIN(self, username, password):
+        if self.checkLogin(username, password):
+            self.loggedIn = True
+            self.loginAccepted()
+        else:
+            self.sendMessage('Login failed')
+            self.flush()
+            self.transport.loseConnection()
+
+    def cmd_META(self, var, value):
+        self.meta[var] = value
+        self.metaReceived(var, value)
+
+    def cmd_MORE(self):
+        if self.loggedIn:
+            self.workRequested()
+
+    def cmd_RESULT(self, result):
+        if not self.loggedIn:
+            return
+        try:
+            data = result.decode('hex')
+        except (TypeError, ValueError):
+            return
+        self.resultReceived(data)
+
+    def checkLogin(self, username, password):
+        """Return whether to accept a login. Everyone is let in by default."""
+        return True
+
+    def loginAccepted(self):
+        """Called once the client has logged in. The client expects its
+        target and its first work to follow.
+        """
+
+    def metaReceived(self, var, value):
+        """Called when the client sets a metavariable."""
+
+    def workRequested(self):
+        """Called when the client asks for more work."""
+
+    def resultReceived(self, result):
+        """Called with the (decoded) data of each result the client sends.
+        Every result should be answered with answerResult.
+        """
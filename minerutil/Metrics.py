@@ -0,0 +1,278 @@
+# Copyright (C) 2011 by jedi95 <jedi95@gmail.com> and
+#                       CFSworks <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import json
+import threading
+from bisect import bisect_left
+from time import time
+
+class Metric(object):
+    """The base of all metrics. A metric may have labels, in which case its
+    values live in children, one per combination of label values, which are
+    created by labels().
+
+    Updating a metric takes no locks: every thread updates cells of its own,
+    which are only added together when the metric is read.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.labelValues = ()
+        self.children = {}
+        self.cells = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the child for the given label values. Callers on hot paths
+        should keep the child around rather than looking it up every time.
+        """
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelNames):
+            raise ValueError('%s takes labels %s' % (self.name,
+                ', '.join(self.labelNames)))
+        child = self.children.get(values)
+        if child is None:
+            self.lock.acquire()
+            try:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.makeChild()
+                    child.labelNames = self.labelNames
+                    child.labelValues = values
+                    self.children[values] = child
+            finally:
+                self.lock.release()
+        return child
+
+    def makeChild(self):
+        return self.__class__(self.name, self.help)
+
+    def newCell(self):
+        cell = self.emptyCell()
+        self.lock.acquire()
+        try:
+            self.cells.append(cell)
+        finally:
+            self.lock.release()
+        self.local.cell = cell
+        return cell
+
+    def emptyCell(self):
+        return [0]
+
+    def samples(self):
+        """Return (labels, value) for this metric and each child."""
+        if self.labelNames and not self.labelValues:
+            samples = []
+            for values, child in sorted(self.children.items()):
+                samples.extend(child.samples())
+            return samples
+        return [(dict(zip(self.labelNames, self.labelValues)), self.get())]
+
+class Counter(Metric):
+    """A number that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, n=1):
+        try:
+            self.local.cell[0] += n
+        except AttributeError:
+            self.newCell()[0] += n
+
+    def get(self):
+        return sum(cell[0] for cell in list(self.cells))
+
+class Histogram(Metric):
+    """Counts observations in fixed buckets, and keeps their sum."""
+
+    type = 'histogram'
+
+    # Upper bounds suitable for latencies, in seconds.
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+        1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help, labelNames=(), buckets=BUCKETS):
+        Metric.__init__(self, name, help, labelNames)
+        self.buckets = tuple(buckets)
+
+    def makeChild(self):
+        return self.__class__(self.name, self.help, buckets=self.buckets)
+
+    def emptyCell(self):
+        # One count per bucket, one for +Inf, and the sum.
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value):
+        try:
+            cell = self.local.cell
+        except AttributeError:
+            cell = self.newCell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def get(self):
+        """Return the count in each bucket (not cumulative), and the sum."""
+        total = self.emptyCell()
+        for cell in list(self.cells):
+            for i, value in enumerate(cell):
+                total[i] += value
+        return {'buckets': total[:-1], 'sum': total[-1],
+            'count': sum(total[:-1])}
+
+class Timer(Histogram):
+    """A Histogram of durations, in seconds."""
+
+    def since(self, startedAt):
+        """Observe the time since startedAt (as given by time.time())."""
+        self.observe(time() - startedAt)
+
+    def time(self):
+        """Time a with-block."""
+        return _Timing(self)
+
+class _Timing(object):
+    def __init__(self, timer):
+        self.timer = timer
+    def __enter__(self):
+        self.startedAt = time()
+    def __exit__(self, *exc):
+        self.timer.since(self.startedAt)
+
+class Gauge(Metric):
+    """A value that is read from a function whenever the metric is read, for
+    numbers that are already kept elsewhere. The function returns either a
+    number, or a list of (label values, number) if the gauge has labels.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, function, labelNames=(), type=None):
+        Metric.__init__(self, name, help, labelNames)
+        self.function = function
+        if type is not None:
+            self.type = type
+
+    def samples(self):
+        if not self.labelNames:
+            return [({}, self.function())]
+        return [(dict(zip(self.labelNames, [str(v) for v in values])), value)
+            for values, value in self.function()]
+
+class Registry(object):
+    """Holds all the metrics, so they can be read together: rendered for
+    Prometheus, taken as a snapshot, or dumped to a file.
+
+    The counter(), histogram() and timer() methods return the existing metric
+    if there's one by that name, so that everything that reports to the same
+    metric shares it.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        self.lock.acquire()
+        try:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError('%s is already a %s' % (name, metric.type))
+            return metric
+        finally:
+            self.lock.release()
+
+    def counter(self, name, help, labelNames=()):
+        return self._get(Counter, name, help, labelNames)
+
+    def histogram(self, name, help, labelNames=(), buckets=Histogram.BUCKETS):
+        return self._get(Histogram, name, help, labelNames, buckets)
+
+    def timer(self, name, help, labelNames=(), buckets=Histogram.BUCKETS):
+        return self._get(Timer, name, help, labelNames, buckets)
+
+    def gauge(self, name, help, function, labelNames=(), type=None):
+        """Register a Gauge, replacing any that had the same name."""
+        gauge = Gauge(name, help, function, labelNames, type)
+        self.lock.acquire()
+        try:
+            self.metrics[name] = gauge
+        finally:
+            self.lock.release()
+        return gauge
+
+    def snapshot(self):
+        """Return the current values of all metrics, as a dict of metric names
+        to lists of (labels, value).
+        """
+        return dict((name, metric.samples())
+            for name, metric in self.metrics.items())
+
+    def render(self):
+        """Render all metrics in the Prometheus text format."""
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            for labels, value in metric.samples():
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    bounds = metric.buckets + ('+Inf',)
+                    for bound, count in zip(bounds, value['buckets']):
+                        cumulative += count
+                        le = dict(labels, le=str(bound))
+                        lines.append('%s_bucket%s %d' % (name,
+                            _formatLabels(le), cumulative))
+                    lines.append('%s_sum%s %r' % (name, _formatLabels(labels),
+                        value['sum']))
+                    lines.append('%s_count%s %d' % (name,
+                        _formatLabels(labels), value['count']))
+                else:
+                    lines.append('%s%s %r' % (name, _formatLabels(labels),
+                        value))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, fileName):
+        """Write a snapshot of all metrics to a file, as JSON."""
+        f = open(fileName, 'w')
+        try:
+            json.dump({'time': time(), 'metrics': self.snapshot()}, f,
+                sort_keys=True)
+        finally:
+            f.close()
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\',
+        '\\\\').replace('"', '\\"')) for name, value in sorted(labels.items()))
+
+# The registry everything reports to.
+registry = Registry()
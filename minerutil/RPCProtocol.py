@@ -24,10 +24,19 @@ import json
 import sys
 import httplib
 import socket
+from time import time
 from twisted.internet import defer, reactor, error, threads
 from twisted.python import failure
 
 from ClientBase import ClientBase, AssignedWork
+from Metrics import registry
+
+getworkTime = registry.timer('phoenix_getwork_seconds',
+    'Time from asking the server for work to receiving it.')
+rpcFailures = registry.counter('phoenix_rpc_failures_total',
+    'getwork requests that failed.')
+longPollPushes = registry.counter('phoenix_longpoll_pushes_total',
+    'Work pushed by the server through long polling.')
 
 class ServerMessage(Exception): pass
 
@@ -141,8 +150,12 @@ class RPCPoller(HTTPBase):
         self._stopCall()
 
         self.currentAsk = self.call('getwork')
+        self.root.record('getwork')
+        askedAt = time()
 
         def errback(failure):
+            self.root.record('failure', failure.getErrorMessage())
+            rpcFailures.inc()
             try:
                 if failure.check(ServerMessage):
                     self.root.runCallback('msg', failure.getErrorMessage())
@@ -158,6 +171,7 @@ class RPCPoller(HTTPBase):
                     (headers, result) = x
                 except TypeError:
                     return
+                getworkTime.since(askedAt)
                 self.root.handleWork(result, headers)
                 self.root.handleHeaders(headers)
             finally:
@@ -274,11 +288,14 @@ class LongPoller(HTTPBase):
         finally:
             self._request()
 
+        longPollPushes.inc()
         self.root.handleWork(result, headers, True)
 
 class RPCClient(ClientBase):
     """The actual root of the whole RPC client system."""
 
+    captureName = 'rpc'
+
     def __init__(self, handler, url):
         self.handler = handler
         self.url = url
@@ -348,6 +365,7 @@ class RPCClient(ClientBase):
         result += '\x00'*48
 
         d = self.poller.call('getwork', [result.encode('hex')])
+        self.record('submit', result.encode('hex'))
 
         def errback(*ignored):
             return False # ANY error while turning in work is a Bad Thing(TM).
@@ -361,6 +379,9 @@ class RPCClient(ClientBase):
                         'TypeError in RPC sendResult callback')
                 return False
 
+            self.record('submitted', result.encode('hex'), accepted,
+                headers.get('x-reject-reason'))
+
             if (not accepted):
                 self.handleRejectReason(headers)
 
@@ -385,6 +406,7 @@ class RPCClient(ClientBase):
         self.poller.setInterval(askrate)
 
     def handleWork(self, work, headers, pushed=False):
+        self.record('work', work, headers, pushed)
         if work is None:
             return;
 
@@ -22,14 +22,22 @@
 # THE SOFTWARE.
 
 import imp
+import signal
 from sys import exit
 from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 from optparse import OptionParser
 
 import minerutil
-from ConsoleLogger import ConsoleLogger
+from minerutil.Capture import CaptureFile
+from ConsoleLogger import ConsoleLogger, JSONLogger
+from LogWriter import LogWriter
 from WorkQueue import WorkQueue
 from Miner import Miner
+from KernelInterface import KernelGroup
+from Profiler import ProfilerControlFactory
+import MetricsServer
+from minerutil.Metrics import registry
 
 class CommandLineOptions(object):
     """Implements the Options interface for user-specified command-line
@@ -43,6 +51,7 @@ class CommandLineOptions(object):
         self.logger = None
         self.kernel = None
         self.queue = None
+        self.capture = None
         self.kernelOptions = {}
         self._parse()
 
@@ -50,6 +59,9 @@ class CommandLineOptions(object):
         parser = OptionParser(usage="%prog -u URL [-k kernel] [kernel params]")
         parser.add_option("-v", "--verbose", action="store_true",
             dest="verbose", default=False, help="show debug messages")
+        parser.add_option("--json", action="store_true", dest="json",
+            default=False, help="log JSON objects, one per line, instead of "
+            "text")
         parser.add_option("-k", "--kernel", dest="kernel", default="phatk2",
             help="the name of the kernel to use")
         parser.add_option("-u", "--url", dest="url", default=None,
@@ -62,6 +74,26 @@ class CommandLineOptions(object):
         parser.add_option("-a", "--avgsamples", dest="avgsamples", type="int",
             default=10,
             help="how many samples to use for hashrate average")
+        parser.add_option("--unittime", dest="unittime", type="int",
+            default=None, help="ask MMP servers for work that takes about "
+            "this many seconds [OPTIONAL]")
+        parser.add_option("--capture", dest="capture", default=None,
+            help="record the traffic with the server to this file, for "
+            "replaying later [OPTIONAL]")
+        parser.add_option("--metrics", dest="metrics", type="int",
+            default=None, help="serve Prometheus metrics over HTTP on this "
+            "port [OPTIONAL]")
+        parser.add_option("--metricsfile", dest="metricsfile", default=None,
+            help="write the metrics to this file as JSON every minute and on "
+            "exit [OPTIONAL]")
+        parser.add_option("--control", dest="control", type="int",
+            default=None, help="listen on this local port for commands to "
+            "start and stop profiling [OPTIONAL]")
+        parser.add_option("--profiledir", dest="profiledir", default=".",
+            help="the directory to write profiling results to")
+        parser.add_option("--sample", action="store_true", dest="sample",
+            default=False, help="sample the stacks of all threads from the "
+            "start, for profiling")
 
         self.parsedSettings, args = parser.parse_args()
 
@@ -89,7 +121,15 @@ class CommandLineOptions(object):
 
     def makeLogger(self, requester, miner):
         if not self.logger:
-            self.logger = ConsoleLogger(miner, self.parsedSettings.verbose)
+            # Writing happens in the background, so that a slow console or
+            # pipe doesn't hold up the reactor.
+            output = LogWriter()
+            reactor.addSystemEventTrigger('after', 'shutdown', output.close)
+            if self.parsedSettings.json:
+                logger = JSONLogger
+            else:
+                logger = ConsoleLogger
+            self.logger = logger(miner, self.parsedSettings.verbose, output)
         return self.logger
 
     def makeConnection(self, requester, backup = False):
@@ -99,6 +139,14 @@ class CommandLineOptions(object):
         except ValueError, e:
             print(e)
             exit()
+        if self.parsedSettings.unittime is not None:
+            connection.setMeta('unittime', self.parsedSettings.unittime)
+        if self.parsedSettings.capture is not None:
+            if not self.capture:
+                self.capture = CaptureFile(self.parsedSettings.capture)
+                reactor.addSystemEventTrigger('after', 'shutdown',
+                    self.capture.close)
+            connection.setCapture(self.capture)
         return connection
 
     def makeKernel(self, requester):
@@ -110,9 +158,67 @@ class CommandLineOptions(object):
                 print("Could not locate the specified kernel!")
                 exit()
             kernelModule = imp.load_module(module, file, filename, smt)
-            self.kernel = kernelModule.MiningKernel(requester)
+            devices = self._kernelDevices(kernelModule.MiningKernel, requester)
+            if devices is None:
+                self.kernel = kernelModule.MiningKernel(requester)
+            else:
+                self.kernel = KernelGroup([
+                    kernelModule.MiningKernel(requester.forDevice(device))
+                    for device in devices])
         return self.kernel
 
+    def _kernelDevices(self, kernelClass, requester):
+        """Returns the list of devices given as DEVICE=0,1,... or DEVICE=all,
+        or None if the kernel should only run a single instance.
+        """
+        devices = self.kernelOptions.get('DEVICE')
+        if devices is None:
+            return None
+
+        if devices.lower() == 'all':
+            getDevices = getattr(kernelClass, 'getDevices', None)
+            if getDevices is None:
+                print("This kernel does not support DEVICE=all!")
+                exit()
+            devices = getDevices(requester)
+            if not devices:
+                print("No devices found, use PLATFORM=ID to select a "
+                    "platform and DEVICE=ID to select a device.")
+                exit()
+            return devices
+
+        devices = [d.strip() for d in devices.split(',') if d.strip()]
+        if len(devices) < 2:
+            return None
+        return devices
+
+    def setupProfiler(self, profiler):
+        """Set up the ways to control the profiler. SIGUSR1 toggles profiling
+        every thread, and SIGUSR2 toggles sampling.
+        """
+        profiler.directory = self.parsedSettings.profiledir
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame:
+                reactor.callFromThread(profiler.toggle))
+            signal.signal(signal.SIGUSR2, lambda signum, frame:
+                reactor.callFromThread(profiler.toggleSampling))
+        if self.parsedSettings.control is not None:
+            reactor.listenTCP(self.parsedSettings.control,
+                ProfilerControlFactory(profiler), interface='127.0.0.1')
+        if self.parsedSettings.sample:
+            profiler.startSampling()
+        reactor.addSystemEventTrigger('before', 'shutdown', profiler.shutdown)
+
+    def setupMetrics(self):
+        if self.parsedSettings.metrics is not None:
+            MetricsServer.listen(self.parsedSettings.metrics, reactor)
+        fileName = self.parsedSettings.metricsfile
+        if fileName is not None:
+            dump = LoopingCall(registry.dump, fileName)
+            dump.start(60, now=False)
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                registry.dump, fileName)
+
     def makeQueue(self, requester):
         if not self.queue:
             self.queue = WorkQueue(requester, self)
@@ -121,6 +227,8 @@ class CommandLineOptions(object):
 if __name__ == '__main__':
     options = CommandLineOptions()
     miner = Miner()
+    options.setupProfiler(miner.profiler)
+    options.setupMetrics()
     miner.start(options)
 
     reactor.run()
\ No newline at end of file